@@ -0,0 +1,305 @@
+import os
+import mmap
+from collections import deque
+from multiprocessing import Pool
+import numpy as np
+
+
+def split_frame_id(frame_id):
+    # "spk_sent_fid" -> ("spk_sent", fid)
+    id, fid = frame_id.rsplit('_', 1)
+    return id, int(fid)
+
+
+def _utt_matrix(fids, rows):
+    # float32, like the binary kaldi arks: half the bytes of float64 to keep
+    # or to send back from a pool worker
+    xs = np.array(' '.join(rows).split(), dtype=np.float32).reshape(len(rows), -1)
+    fids = np.array(fids)
+    if np.any(fids[1:] < fids[:-1]):
+        xs = xs[np.argsort(fids, kind='stable')]
+    return xs
+
+
+def is_grouped(fn):
+    # cheap id-only pass: are all frames of an utterance contiguous?
+    seen = set()
+    pre = None
+    with open(fn, 'r') as fp:
+        for line in fp:
+            id = line.split(' ', 1)[0].rsplit('_', 1)[0]
+            if id != pre:
+                if id in seen:
+                    return False
+                seen.add(id)
+                pre = id
+    return True
+
+
+def ark_ids(fn):
+    # cheap id-only pass: utterance ids in the order iter_ark yields them
+    first = {}
+    order = []
+    grouped = True
+    pre = None
+    with open(fn, 'r') as fp:
+        for i, line in enumerate(fp):
+            id, fid = split_frame_id(line.split(' ', 1)[0])
+            if id != pre:
+                if id in first:
+                    grouped = False
+                else:
+                    order.append(id)
+                pre = id
+            if id not in first or fid < first[id][0]:
+                first[id] = (fid, i)
+    if grouped:
+        return order
+    return sorted(order, key=lambda id: first[id])
+
+
+def iter_ark(fn, grouped=None, keep=None):
+    # yields (utterance id, (n_frames x n_feat) array) in file order, frames
+    # sorted by frame index. Only one utterance is held in memory when the
+    # file is grouped by utterance, which is checked first unless told.
+    # With keep (a set of ids) the other utterances are skipped unparsed.
+    if grouped is None:
+        grouped = is_grouped(fn)
+    if not grouped:
+        print("%s is not grouped by utterance, buffering it" % fn)
+        yield from _iter_ark_buffered(fn, keep)
+        return
+
+    with open(fn, 'r') as fp:
+        yield from _iter_lines(fp, keep)
+
+
+def _iter_lines(lines, keep=None):
+    pre = None
+    fids, rows = [], []
+    for line in lines:
+        frame_id, row = line.rstrip('\n').split(' ', 1)
+        id, fid = split_frame_id(frame_id)
+        if id != pre:
+            if pre is not None and (keep is None or pre in keep):
+                yield pre, _utt_matrix(fids, rows)
+            pre = id
+            fids, rows = [], []
+        fids.append(fid)
+        rows.append(row)
+    if pre is not None and (keep is None or pre in keep):
+        yield pre, _utt_matrix(fids, rows)
+
+
+# bytes of text per shard for the pool; the parsed float32 frames of one
+# shard take well under 1 MB
+SHARD_BYTES = 2 ** 21
+
+
+def shard_offsets(fn, n_shards):
+    # byte offsets [0, ..., size] cutting a grouped ark into about n_shards
+    # pieces, every cut on the first line of an utterance
+    size = os.path.getsize(fn)
+    cuts = [0]
+    with open(fn, 'rb') as fp:
+        for k in range(1, n_shards):
+            target = size * k // n_shards
+            if target <= cuts[-1]:
+                continue
+            fp.seek(target - 1)
+            fp.readline()
+            pos = fp.tell()
+            line = fp.readline()
+            if not line:
+                break
+            id = line.split(b' ', 1)[0].rsplit(b'_', 1)[0]
+            while True:
+                pos = fp.tell()
+                line = fp.readline()
+                if not line or line.split(b' ', 1)[0].rsplit(b'_', 1)[0] != id:
+                    break
+            if line and pos > cuts[-1]:
+                cuts.append(pos)
+    cuts.append(size)
+    return cuts
+
+
+def _parse_shard(shard):
+    fn, start, end, keep = shard
+    with open(fn, 'rb') as fp:
+        fp.seek(start)
+        text = fp.read(end - start).decode()
+    return list(_iter_lines(text.splitlines(), keep))
+
+
+def iter_ark_sharded(fn, pool, n_ahead, keep=None):
+    # shards of about SHARD_BYTES are parsed in the pool and handed back in
+    # file order, so the output is the same as iter_ark whatever the number
+    # of workers. At most n_ahead shards of the ark are in flight: memory
+    # stays flat, and arks sharing the pool (feat=all) take turns in it.
+    if not is_grouped(fn):
+        yield from iter_ark(fn, False, keep)
+        return
+    cuts = shard_offsets(fn, max(n_ahead, os.path.getsize(fn) // SHARD_BYTES))
+    pending = deque()
+    for k in range(len(cuts) - 1):
+        pending.append(pool.apply_async(_parse_shard, ((fn, cuts[k], cuts[k + 1], keep),)))
+        if len(pending) >= n_ahead:
+            yield from pending.popleft().get()
+    while pending:
+        yield from pending.popleft().get()
+
+
+def _iter_ark_buffered(fn, keep=None):
+    # same utterance order as a stable sort of all frames by frame index:
+    # by first frame index, then by where that frame sits in the file
+    utts = {}
+    first = {}
+    with open(fn, 'r') as fp:
+        for i, line in enumerate(fp):
+            frame_id, row = line.rstrip('\n').split(' ', 1)
+            id, fid = split_frame_id(frame_id)
+            if keep is not None and id not in keep:
+                continue
+            if id not in utts:
+                utts[id] = ([], [])
+            utts[id][0].append(fid)
+            utts[id][1].append(row)
+            if id not in first or fid < first[id][0]:
+                first[id] = (fid, i)
+    for id in sorted(utts.keys(), key=lambda id: first[id]):
+        fids, rows = utts.pop(id)
+        yield id, _utt_matrix(fids, rows)
+
+
+def iter_utts(fs, grouped=None, n_workers=1, keep=None):
+    # joins several arks of the same utterances frame by frame (feat=all).
+    # Arks in the same utterance order are zipped as streams; an ark that
+    # falls out of step is read into a dict and looked up instead.
+    if n_workers > 1:
+        with Pool(n_workers) as pool:
+            # two shards per worker keeps the pool busy to the end
+            its = [iter_ark_sharded(f, pool, 2 * n_workers, keep) for f in fs]
+            yield from _join_utts(fs, its)
+    else:
+        its = [iter_ark(f, grouped, keep) for f in fs]
+        yield from _join_utts(fs, its)
+
+
+def _join_utts(fs, its):
+    rest = [None for _ in fs]
+    for id, xs in its[0]:
+        feats = [xs]
+        for k in range(1, len(fs)):
+            if rest[k] is None:
+                oid, oxs = next(its[k], (None, None))
+                if oid == id:
+                    feats.append(oxs)
+                    continue
+                print("%s is not in the order of %s, buffering it" % (fs[k], fs[0]))
+                rest[k] = dict(its[k])
+                if oid is not None:
+                    rest[k][oid] = oxs
+            feats.append(rest[k].pop(id))
+        if len(feats) == 1:
+            yield id, xs
+        else:
+            yield id, np.hstack(feats)
+
+
+def read_labels(lab_f, lab2id):
+    # {utterance id: int64 labels sorted by frame index}
+    y = {}
+    with open(lab_f, 'r') as f:
+        for line in f:
+            frame_id, lab = line.rstrip('\n').split(',')
+            id, fid = split_frame_id(frame_id)
+            if id not in y:
+                y[id] = ([], [])
+            y[id][0].append(fid)
+            y[id][1].append(lab2id[lab])
+    for id, (fids, labs) in y.items():
+        labs = np.array(labs, dtype=np.int64)
+        fids = np.array(fids)
+        if np.any(fids[1:] < fids[:-1]):
+            labs = labs[np.argsort(fids, kind='stable')]
+        y[id] = labs
+    return y
+
+
+
+# Kaldi binary matrices: "\0B" then "FM " (float32) or "DM " (float64),
+# then "\4" int32 rows and "\4" int32 cols, then the row-major data.
+KALDI_TYPES = {b"FM ": np.dtype('<f4'), b"DM ": np.dtype('<f8')}
+
+
+def read_kaldi_mat(buf, offset):
+    # returns (rows x cols) array viewing buf without a copy, and the end offset
+    if buf[offset:offset + 2] != b"\0B":
+        raise ValueError("offset %d is not a binary kaldi object" % offset)
+    token = bytes(buf[offset + 2:offset + 5])
+    if token not in KALDI_TYPES:
+        raise ValueError("unsupported kaldi matrix type %r (compressed?)" % token)
+    dtype = KALDI_TYPES[token]
+    if buf[offset + 5:offset + 6] != b"\4" or buf[offset + 10:offset + 11] != b"\4":
+        raise ValueError("bad kaldi matrix header at %d" % offset)
+    rows = int(np.frombuffer(buf, dtype='<i4', count=1, offset=offset + 6)[0])
+    cols = int(np.frombuffer(buf, dtype='<i4', count=1, offset=offset + 11)[0])
+    start = offset + 15
+    xs = np.frombuffer(buf, dtype=dtype, count=rows * cols, offset=start)
+    return xs.reshape(rows, cols), start + rows * cols * dtype.itemsize
+
+
+def _map_file(fn):
+    with open(fn, 'rb') as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+class KaldiScp():
+    # random access to binary arks through "key path:offset" scp lines;
+    # every ark is mapped once and matrices are views into the map
+    def __init__(self, scp_fn):
+        self.ids = []
+        self.entries = {}
+        self.maps = {}
+        base = os.path.dirname(scp_fn)
+        with open(scp_fn, 'r') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                id, loc = line.split(None, 1)
+                path, offset = loc.strip().rsplit(':', 1)
+                if not os.path.exists(path):
+                    path = os.path.join(base, os.path.basename(path))
+                self.ids.append(id)
+                self.entries[id] = (path, int(offset))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, id):
+        return id in self.entries
+
+    def __getitem__(self, id):
+        path, offset = self.entries[id]
+        if path not in self.maps:
+            self.maps[path] = _map_file(path)
+        return read_kaldi_mat(self.maps[path], offset)[0]
+
+    def __iter__(self):
+        for id in self.ids:
+            yield id, self[id]
+
+
+def iter_kaldi_utts(scps, keep=None):
+    # scp counterpart of iter_utts: utterances in the order of the first
+    # scp, features of the others joined by utterance id
+    readers = [KaldiScp(f) for f in scps]
+    for id in readers[0].ids:
+        if keep is not None and id not in keep:
+            continue
+        feats = [r[id] for r in readers]
+        if len(feats) == 1:
+            yield id, feats[0]
+        else:
+            yield id, np.hstack(feats)
@@ -0,0 +1,162 @@
+import argparse
+import os
+import multiprocessing
+from util import *
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('data', default='./data/',
+                    help='data folder')
+parser.add_argument('bench', default='norm',
+                    help='norm or parse or loader')
+parser.add_argument('-f', '--feats', type=str, default='mfcc,fbank,all',
+                    help='comma separated feature sets')
+parser.add_argument('-r', '--repeat', type=int, default=int(3))
+parser.add_argument('-w', '--workers', type=str, default='',
+                    help='comma separated worker counts (default 1, 2, 4, .. cpu count)')
+parser.add_argument('-b', '--batch_size', type=int, default=int(32))
+parser.add_argument('-H', '--hidden_size', type=int, default=int(64),
+                    help='hidden size of the brnn trained in the loader benchmark')
+parser.add_argument('-a', '--ahead', type=str, default='0,1,2,4',
+                    help='comma separated prefetch depths for the loader benchmark')
+args = parser.parse_args()
+
+
+def best_of(fn):
+    best = None
+    for _ in range(args.repeat):
+        start = time.time()
+        fn()
+        t = time.time() - start
+        best = t if best is None else min(best, t)
+    return best
+
+
+def bench_norm(feat):
+    from scipy import stats
+    pairs = read_data(ark_files(args.data, feat, "train"), None, None, "none")
+    xss = [xs for (xs, id) in pairs]
+    n_frames = sum(len(xs) for xs in xss)
+
+    def per_frame_loop():
+        # what read_data used to do: one zscore call per frame id
+        for xs in xss:
+            np.array([stats.zscore(list(x)) for x in xs])
+
+    def per_utt():
+        for xs in xss:
+            normalize(xs, "frame")
+
+    full = np.concatenate(xss)
+
+    def full_matrix():
+        normalize(full, "frame")
+
+    def utt_cmvn():
+        for xs in xss:
+            normalize(xs, "utt")
+
+    def global_cmvn():
+        cmvn = CMVNStats()
+        for xs in xss:
+            cmvn.update(xs)
+        normalize(full, "global", (cmvn.mean, cmvn.std()))
+
+    base = best_of(per_frame_loop)
+    print("%-6s %8d frames" % (feat, n_frames))
+    print("  %-28s %8.3fs" % ("zscore loop (old)", base))
+    for name, fn in [("frame z-score, per utterance", per_utt),
+                     ("frame z-score, full matrix", full_matrix),
+                     ("utterance cmvn", utt_cmvn),
+                     ("global cmvn (streamed stats)", global_cmvn)]:
+        t = best_of(fn)
+        print("  %-28s %8.3fs  x%.1f" % (name, t, base / t))
+
+
+def bench_parse(feat):
+    fs = ark_files(args.data, feat, "train")
+    mb = sum(os.path.getsize(f) for f in fs) / 2**20
+    if args.workers:
+        workers = [int(w) for w in args.workers.split(',')]
+    else:
+        workers = [1]
+        while workers[-1] * 2 <= multiprocessing.cpu_count():
+            workers.append(workers[-1] * 2)
+    print("%-6s %8.1f MB, %d cores" % (feat, mb, multiprocessing.cpu_count()))
+    base = None
+    for w in workers:
+        t, rss = in_fork(parse_run, fs, w)
+        base = t if base is None else base
+        print("  %2d workers %8.3fs %8.1f MB/s  x%.2f  peak RSS +%6.1f MB" % (w, t, mb / t, base / t, rss))
+
+
+def parse_run(fs, w, queue):
+    # best time over the repeats and the growth of the peak RSS: the
+    # parsed utterances are dropped at once, so the growth is what the
+    # reader itself buffers
+    base = rss_mb()
+    t = best_of(lambda: sum(1 for _ in iter_utts(fs, n_workers=w)))
+    queue.put((t, peak_rss_mb() - base))
+
+
+def in_fork(fn, *args):
+    # the peak RSS only goes up, so every run gets a fresh process
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    p = ctx.Process(target=fn, args=args + (queue,))
+    p.start()
+    res = queue.get()
+    p.join()
+    return res
+
+
+def bench_loader(feat):
+    import random
+    import hashlib
+    import torch.nn as nn
+    from timit import TIMIT
+    from loader import Prefetcher, seq_batches
+    import model_brnn
+
+    timit = TIMIT(args.data, "tr", feat)
+    model = model_brnn.BRNN(timit.N_FEAT, args.hidden_size, timit.N_LABEL, args.batch_size)
+    if USE_CUDA:
+        model.cuda()
+    opt = torch.optim.Adam(model.parameters())
+    criterion = nn.CrossEntropyLoss()
+    random.seed(0)
+    random.shuffle(timit.tr_set)
+    batches = seq_batches(len(timit.tr_set), args.batch_size)
+    n_frames = sum(len(ys) for (ys, xs, id) in timit.tr_set)
+
+    print("%-6s %8d frames, brnn h%d b%d" % (feat, n_frames, args.hidden_size, args.batch_size))
+    base = None
+    digest = None
+    for n_ahead in [int(a) for a in args.ahead.split(',')]:
+        loader = Prefetcher(timit, args.batch_size, n_ahead, max(1, n_ahead // 2))
+        h = hashlib.md5()
+        start = time.time()
+        for input, target, ids, useful, lens in loader(batches):
+            h.update(input.data.cpu().numpy().tobytes())
+            h.update(target.data.cpu().numpy().tobytes())
+            model.zero_grad()
+            output, hidden = model(input, model.init_hidden(len(lens)), lens)
+            loss = criterion(output.view(-1, timit.N_LABEL), target.view(-1))
+            loss.backward()
+            opt.step()
+        t = time.time() - start
+        base = t if base is None else base
+        digest = h.hexdigest() if digest is None else digest
+        print("  ahead %d %8.3fs %10.1f frames/s  waiting %6.3fs  x%.2f %s" % (
+            n_ahead, t, n_frames / t, loader.wait_time, base / t,
+            "same batches" if h.hexdigest() == digest else "DIFFERENT BATCHES"))
+
+
+if args.bench == "norm":
+    for feat in args.feats.split(','):
+        bench_norm(feat)
+elif args.bench == "parse":
+    for feat in args.feats.split(','):
+        bench_parse(feat)
+elif args.bench == "loader":
+    for feat in args.feats.split(','):
+        bench_loader(feat)
@@ -0,0 +1,104 @@
+import argparse
+import os
+from util import *
+from timit import *
+from decode import *
+from models import *
+from loader import *
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('data', default='./data/',
+                    help='data folder')
+parser.add_argument('feat', default='mfcc',
+                    help='mfcc or fbank or all')
+parser.add_argument('model', default='brnn',
+                    help='model (rnn or cnn or brnn or bcnn or res or bres)')
+parser.add_argument('model_file', default='brnn.pt',
+                    help='model file')
+parser.add_argument('-wx', '--window_size_x', type=int, default=int(3))
+parser.add_argument('-wy', '--window_size_y', type=int, default=int(2))
+parser.add_argument('-p', '--pool_size', type=int, default=int(2))
+parser.add_argument('-H', '--hidden_size', type=int, default=int(20))
+parser.add_argument('-b', '--batch_size', type=int, default=int(64))
+parser.add_argument('-n', '--n_layers', type=int, default=int(1))
+parser.add_argument('-d', '--dropout', type=float, default=int(0.0))
+parser.add_argument('-N', '--norm', type=str, default='frame',
+                    help='frame or utt or global or none')
+parser.add_argument('-r', '--repeat', type=int, default=int(3))
+parser.add_argument('-T', '--trans', type=str, default='train',
+                    help='viterbi: transition matrix, "" uniform, "train" from train.lab, or a .npy of log probs')
+parser.add_argument('--self_loop', type=float, default=float(0.9))
+parser.add_argument('--min_durs', type=str, default='1,2,3,4',
+                    help='comma separated minimum durations for viterbi')
+parser.add_argument('--seed', type=int, default=int(0),
+                    help='the seed train.py was given (train.py --seed), so the validation utterances were held out')
+args = parser.parse_args()
+
+
+def best_of(fn):
+    best = None
+    res = None
+    for _ in range(args.repeat):
+        start = time.time()
+        res = fn()
+        t = time.time() - start
+        best = t if best is None else min(best, t)
+    return best, res
+
+
+# log-posteriors of the validation split, computed once
+random.seed(args.seed)
+timit = TIMIT(args.data, "tr", args.feat, args.norm)
+model = build_model(args.model, timit.N_FEAT, timit.N_LABEL, args.hidden_size, args.batch_size,
+                    args.n_layers, args.dropout, (args.window_size_x, args.window_size_y),
+                    args.pool_size)
+state_dict = torch.load(os.path.join("models", args.model_file), map_location=lambda storage, location: storage)
+model.load_state_dict(state_dict)
+model = model.eval()
+if USE_CUDA:
+    model.cuda()
+
+codes = char_codes(timit.id2ascii, timit.N_LABEL)
+SIL = codes[timit.lab2id['sil']]
+
+posts = []
+refs = []
+loader = Prefetcher(timit, args.batch_size)
+for input, target, ids, useful, lens in loader(seq_batches(len(timit.valid_set), args.batch_size), "va"):
+    with torch.no_grad():
+        output, hidden = model(input, model.init_hidden(len(lens)), lens)
+    lp = F.log_softmax(output, 2).data.cpu().numpy()
+    ys = target.data.cpu().numpy()
+    for i in range(useful):
+        posts.append(lp[i, :lens[i]])
+        refs.append(to_str(trim(codes[ys[i, :lens[i]]], SIL, 1)))
+n_frames = sum(len(lp) for lp in posts)
+log_trans = load_transitions(args.trans, args.data, timit.lab2id, timit.N_LABEL, args.self_loop)
+order = np.argsort([len(lp) for lp in posts], kind='stable')
+
+
+def run_trim(method):
+    return [post_process(lp.argmax(1), codes, SIL, method) for lp in posts]
+
+
+def run_viterbi(min_dur):
+    res = [None] * len(posts)
+    for i in range(0, len(order), args.batch_size):
+        batch = order[i:i + args.batch_size]
+        for k, ans in zip(batch, viterbi_decode([posts[k] for k in batch], codes, SIL, log_trans, min_dur)):
+            res[k] = ans
+    return res
+
+
+def report(name, t, hyps):
+    dist = edit_distances([[ord(c) for c in h] for h in hyps], [[ord(c) for c in r] for r in refs]).mean()
+    print("  %-12s %8.3fs %10.1f frames/s  edit distance %.3f" % (name, t, n_frames / t, dist))
+
+
+print("%s: %d validation utterances, %d frames" % (args.model_file, len(posts), n_frames))
+for method in ["trim", "trim2"]:
+    t, hyps = best_of(lambda: run_trim(method))
+    report(method, t, hyps)
+for min_dur in [int(d) for d in args.min_durs.split(',')]:
+    t, hyps = best_of(lambda: run_viterbi(min_dur))
+    report("viterbi d%d" % min_dur, t, hyps)
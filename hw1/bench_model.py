@@ -0,0 +1,415 @@
+import argparse
+import json
+import subprocess
+import torch
+import torch.nn as nn
+from torch.autograd import Variable
+from util import *
+from models import *
+import model_dnn
+import model_dcnn
+from subsample import pyramid_steps
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('bench', default='loss',
+                    help='loss or stream or subsample or checkpoint or throughput')
+parser.add_argument('-m', '--models', type=str, default='brnn,res',
+                    help='comma separated models, or all (throughput: also dnn and dcnn)')
+parser.add_argument('-f', '--n_feat', type=int, default=int(39))
+parser.add_argument('-H', '--hidden_size', type=int, default=int(100))
+parser.add_argument('-b', '--batch_size', type=int, default=int(32))
+parser.add_argument('-n', '--n_layers', type=int, default=int(2))
+parser.add_argument('-r', '--repeat', type=int, default=int(10))
+parser.add_argument('-c', '--chunks', type=str, default='1,4,10,32,100',
+                    help='comma separated chunk sizes (frames) for the stream benchmark')
+parser.add_argument('--check', action='store_true',
+                    help='stream: check that the chunked output plus a flush call equals the full-utterance forward')
+parser.add_argument('-s', '--subs', type=str, default='1:stack,2:stack,3:stack,2:stride,3:stride,2:pyramid,4:pyramid',
+                    help='comma separated factor:mode for the subsample benchmark')
+parser.add_argument('-k', '--checkpoints', type=str, default='none,1,1-2,all',
+                    help='comma separated RES block sets (1-3: blocks 1 to 3) for the checkpoint benchmark')
+parser.add_argument('--batches', type=str, default='4,8,16,32',
+                    help='comma separated batch sizes for the checkpoint benchmark')
+parser.add_argument('-T', '--frames', type=int, default=int(780),
+                    help='utterance length for the checkpoint benchmark (780: the longest in TIMIT)')
+parser.add_argument('--mem', type=float, default=float(8192),
+                    help='memory (MB) the largest batch has to fit in')
+parser.add_argument('--hiddens', type=str, default='',
+                    help='comma separated hidden sizes for the throughput benchmark (default: -H)')
+parser.add_argument('--threads', type=str, default='',
+                    help='comma separated torch.set_num_threads values for the throughput benchmark (default: as is)')
+parser.add_argument('--frame_size', type=int, default=int(17),
+                    help='frames per dnn / dcnn input window')
+parser.add_argument('-o', '--output', type=str, default='',
+                    help='write the throughput results to this JSON file')
+parser.add_argument('--baseline', type=str, default='',
+                    help='JSON file of an earlier throughput run to compare with')
+parser.add_argument('--seed', type=int, default=int(0))
+args = parser.parse_args()
+
+N_LABEL = 39 + 1
+
+
+def timit_lens(n):
+    # TIMIT utterances run from about 100 to 780 frames, mean ~310
+    lens = np.random.lognormal(np.log(300), 0.3, size=n)
+    return sorted(np.clip(lens, 90, 780).astype(int).tolist(), reverse=True)
+
+
+def synthetic_batch(B):
+    lens = timit_lens(B)
+    T = lens[0]
+    x = torch.randn(B, T, args.n_feat)
+    y = torch.LongTensor(B, T).random_(1, N_LABEL)
+    for k, l in enumerate(lens):
+        x[k, l:] = 0
+        y[k, l:] = 0
+    x, y = Variable(x), Variable(y)
+    if USE_CUDA:
+        x, y = x.cuda(), y.cuda()
+    return x, y, lens
+
+
+def sync():
+    if USE_CUDA:
+        torch.cuda.synchronize()
+
+
+def time_steps(step):
+    step()
+    sync()
+    res = []
+    for _ in range(args.repeat):
+        start = time.time()
+        step()
+        sync()
+        res.append(time.time() - start)
+    return np.array(res)
+
+
+def bench_loss(name):
+    model = build_model(name, args.n_feat, N_LABEL, args.hidden_size, args.batch_size, args.n_layers)
+    if USE_CUDA:
+        model.cuda()
+    opt = torch.optim.Adam(model.parameters())
+    weight = torch.ones(N_LABEL)
+    weight[1] = 0.3
+    if USE_CUDA:
+        weight = weight.cuda()
+    criterion = nn.CrossEntropyLoss(weight)
+    weight = Variable(weight)
+    x, y, lens = synthetic_batch(args.batch_size)
+
+    def loop_step():
+        model.zero_grad()
+        output, hidden = model(x, model.init_hidden(len(lens)), lens)
+        loss = 0
+        for j in range(len(lens)):
+            loss += criterion(output[j][:lens[j]], y[j][:lens[j]])
+        loss.backward()
+        opt.step()
+
+    def masked_step():
+        model.zero_grad()
+        output, hidden = model(x, model.init_hidden(len(lens)), lens)
+        loss = masked_ce(output, y, lens, weight).sum()
+        loss.backward()
+        opt.step()
+
+    # the loss alone, forward and backward, on a fixed model output
+    output = Variable(model(x, model.init_hidden(len(lens)), lens)[0].data, requires_grad=True)
+
+    def loop_loss():
+        loss = 0
+        for j in range(len(lens)):
+            loss += criterion(output[j][:lens[j]], y[j][:lens[j]])
+        loss.backward()
+
+    def masked_loss():
+        masked_ce(output, y, lens, weight).sum().backward()
+
+    print("%-5s h%d l%d b%d" % (name, args.hidden_size, args.n_layers, args.batch_size))
+    for what, loop, masked in [("step", loop_step, masked_step), ("loss only", loop_loss, masked_loss)]:
+        t_loop = np.median(time_steps(loop))
+        t_mask = np.median(time_steps(masked))
+        print("  %-10s per-utterance loop %9.1f ms, masked %9.1f ms (x%.2f)" % (
+            what, t_loop * 1000, t_mask * 1000, t_loop / t_mask))
+
+
+def bench_stream(name):
+    from stream import Streamer
+    model = build_model(name, args.n_feat, N_LABEL, args.hidden_size, 1, args.n_layers)
+    if USE_CUDA:
+        model.cuda()
+    streamer = Streamer(model)
+    x = torch.randn(300, args.n_feat)
+
+    print("%-5s h%d l%d, lookahead %d frames, 300-frame utterance" % (
+        name, args.hidden_size, args.n_layers, streamer.lookahead))
+    for cs in [int(c) for c in args.chunks.split(',')]:
+        times = []
+        for _ in range(args.repeat):
+            for i in range(0, len(x), cs):
+                start = time.time()
+                streamer(x[i:i + cs], last=i + cs >= len(x))
+                sync()
+                times.append(time.time() - start)
+        times = np.array(times) * 1000
+        # 10 ms frames: a frame is out (chunk + lookahead) frames plus the
+        # compute time after it was spoken, at worst
+        print("  chunk %3d  %7.2f ms/chunk (p95 %7.2f)  %6.3f ms/frame  latency %6.1f ms" % (
+            cs, times.mean(), np.percentile(times, 95), times.mean() / cs,
+            (cs + streamer.lookahead) * 10 + np.percentile(times, 95)))
+        if args.check:
+            check_stream(model, streamer, x, cs)
+
+
+def check_stream(model, streamer, x, cs):
+    # feed every chunk as a live one, then an empty last chunk to flush the
+    # lookahead; the frames have to match one forward over the utterance
+    with torch.no_grad():
+        full = x.view(1, len(x), args.n_feat)
+        if USE_CUDA:
+            full = full.cuda()
+        full = model(full, model.init_hidden(1), [len(x)])[0][0]
+    outs = [streamer(x[i:i + cs]) for i in range(0, len(x), cs)]
+    outs.append(streamer(x[:0], last=True))
+    out = torch.cat(outs)
+    if out.size(0) != full.size(0):
+        raise AssertionError("chunk %d: %d frames streamed, %d in the utterance" % (cs, out.size(0), full.size(0)))
+    diff = (out - full).abs().max().item()
+    print("  chunk %3d  max |stream - full| %.2e%s" % (cs, diff, "" if diff < 1e-4 else "  MISMATCH"))
+
+
+def bench_subsample(name):
+    weight = Variable(torch.ones(N_LABEL))
+    if USE_CUDA:
+        weight = weight.cuda()
+    x, y, lens = synthetic_batch(args.batch_size)
+    n_frames = sum(lens)
+
+    print("%-5s h%d l%d b%d, %d frames per batch" % (name, args.hidden_size, args.n_layers, args.batch_size, n_frames))
+    base = None
+    for sub in args.subs.split(','):
+        k, mode = sub.split(':')
+        if mode == "pyramid" and len(pyramid_steps(int(k))) > args.n_layers - 1:
+            print("  x%s %-8s skipped: needs at least %d layers (-n)" % (k, mode, len(pyramid_steps(int(k))) + 1))
+            continue
+        model = build_model(name, args.n_feat, N_LABEL, args.hidden_size, args.batch_size, args.n_layers,
+                            subsample=int(k), sub_mode=mode)
+        if USE_CUDA:
+            model.cuda()
+        opt = torch.optim.Adam(model.parameters())
+
+        def train_step():
+            model.train()
+            model.zero_grad()
+            output, hidden = model(x, model.init_hidden(len(lens)), lens)
+            masked_ce(output, y, lens, weight).sum().backward()
+            opt.step()
+
+        def infer_step():
+            model.eval()
+            with torch.no_grad():
+                model(x, model.init_hidden(len(lens)), lens)
+
+        t_train = np.median(time_steps(train_step))
+        t_infer = np.median(time_steps(infer_step))
+        base = base or (t_train, t_infer)
+        print("  x%s %-8s train %9.1f frames/s (x%.2f)  infer %9.1f frames/s (x%.2f)" % (
+            k, mode, n_frames / t_train, base[0] / t_train, n_frames / t_infer, base[1] / t_infer))
+
+
+def activation_mb(model, x, y, lens, weight):
+    # one training step; on GPU the peak allocated on top of what was there
+    # before, on CPU the tensors saved for backward (the checkpointed blocks
+    # keep only their input, which checkpoint saves out of sight of the hook)
+    if USE_CUDA:
+        torch.cuda.synchronize()
+        base = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+        output, hidden = model(x, model.init_hidden(len(lens)), lens)
+        masked_ce(output, y, lens, weight).sum().backward()
+        torch.cuda.synchronize()
+        return (torch.cuda.max_memory_allocated() - base) / 2 ** 20
+    seen = {}
+
+    def pack(t):
+        seen[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+
+    def keep_input(block, input):
+        pack(input[0])
+
+    hooks = [m.register_forward_pre_hook(keep_input) for m in model.modules() if getattr(m, "checkpoint", False)]
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        output, hidden = model(x, model.init_hidden(len(lens)), lens)
+        loss = masked_ce(output, y, lens, weight).sum()
+    loss.backward()
+    for h in hooks:
+        h.remove()
+    return sum(seen.values()) / 2 ** 20
+
+
+def bench_checkpoint(name):
+    from recompute import res_blocks
+    weight = Variable(torch.ones(N_LABEL))
+    if USE_CUDA:
+        weight = weight.cuda()
+    batches = [int(b) for b in args.batches.split(',')]
+
+    print("%-5s h%d l%d, %d frames per utterance, %s MB to fit in (%s)" % (
+        name, args.hidden_size, args.n_layers, args.frames, args.mem,
+        "peak allocated" if USE_CUDA else "saved for backward"))
+    base = {}
+    for spec in args.checkpoints.split(','):
+        model = build_model(name, args.n_feat, N_LABEL, args.hidden_size, max(batches), args.n_layers,
+                            checkpoint=res_blocks(spec))
+        if USE_CUDA:
+            model.cuda()
+        model.train()
+        mbs = []
+        for B in batches:
+            x = torch.randn(B, args.frames, args.n_feat)
+            y = torch.LongTensor(B, args.frames).random_(1, N_LABEL)
+            x, y = Variable(x), Variable(y)
+            if USE_CUDA:
+                x, y = x.cuda(), y.cuda()
+            lens = [args.frames] * B
+
+            def train_step():
+                model.zero_grad()
+                output, hidden = model(x, model.init_hidden(B), lens)
+                masked_ce(output, y, lens, weight).sum().backward()
+
+            mb = activation_mb(model, x, y, lens, weight)
+            t = np.median(time_steps(train_step))
+            base.setdefault(B, (mb, t))
+            mbs.append(mb)
+            print("  %-6s b%-3d %9.1f MB (x%.2f)  step %8.1f ms (x%.2f)" % (
+                spec, B, mb, mb / base[B][0], t * 1000, t / base[B][1]))
+        # memory is linear in the batch size
+        print("  %-6s largest batch in %s MB: %s" % (spec, args.mem, batch_str(largest_batch(batches, mbs, args.mem))))
+
+
+def build_any(name, H, B):
+    # dnn / dcnn take one window of frame_size frames per output frame
+    if name == "dnn":
+        return model_dnn.DNN(args.n_feat, args.frame_size, H, N_LABEL, B)
+    if name == "dcnn":
+        return model_dcnn.CNN(args.n_feat, args.frame_size, H, N_LABEL, B, args.n_layers)
+    return build_model(name, args.n_feat, N_LABEL, H, B, args.n_layers)
+
+
+def throughput(name, H, B):
+    model = build_any(name, H, B)
+    if USE_CUDA:
+        model.cuda()
+    model.train()
+    opt = torch.optim.Adam(model.parameters())
+    frames = []
+    times = {"forward": [], "backward": [], "step": []}
+    # the first step is a warm-up, every step gets new utterance lengths
+    for i in range(args.repeat + 1):
+        x, y, lens = synthetic_batch(B)
+        if name in ("dnn", "dcnn"):
+            n = sum(lens)
+            x = Variable(x.data.new(n, args.frame_size, args.n_feat).normal_())
+            y = Variable(y.data.new(n).random_(1, N_LABEL))
+            model.batch_size = n
+        opt.zero_grad()
+        sync()
+        start = time.time()
+        if name in ("dnn", "dcnn"):
+            loss = F.cross_entropy(model(x), y)
+        else:
+            output, hidden = model(x, model.init_hidden(len(lens)), lens)
+            loss = masked_ce(output, y, lens).sum()
+        sync()
+        t_forward = time.time()
+        loss.backward()
+        sync()
+        t_backward = time.time()
+        opt.step()
+        sync()
+        t_step = time.time()
+        if i == 0:
+            continue
+        frames.append(sum(lens))
+        times["forward"].append(t_forward - start)
+        times["backward"].append(t_backward - t_forward)
+        times["step"].append(t_step - t_backward)
+    total = np.sum([times[k] for k in times], 0)
+    res = {"model": name, "hidden_size": H, "n_layers": args.n_layers, "batch_size": B,
+           "threads": torch.get_num_threads(), "frames": int(np.sum(frames)),
+           "frames_per_s": float(np.sum(frames) / total.sum())}
+    for k in times:
+        res[k + "_ms"] = float(np.mean(times[k]) * 1000)
+    for q in (50, 90, 99):
+        res["p%d_ms" % q] = float(np.percentile(total, q) * 1000)
+    return res
+
+
+def config_key(r):
+    return (r["model"], r["hidden_size"], r["n_layers"], r["batch_size"], r["threads"])
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], universal_newlines=True,
+                                       cwd=os.path.dirname(os.path.abspath(__file__)),
+                                       stderr=subprocess.DEVNULL).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return ""
+
+
+def bench_throughput(names):
+    hiddens = [int(h) for h in (args.hiddens or str(args.hidden_size)).split(',')]
+    batches = [int(b) for b in args.batches.split(',')]
+    threads = [int(t) for t in args.threads.split(',')] if args.threads else [torch.get_num_threads()]
+    base = {}
+    if args.baseline:
+        with open(args.baseline) as f:
+            base = dict((config_key(r), r) for r in json.load(f)["results"])
+
+    print("%d steps per config, lengths as in TIMIT, %s" % (args.repeat, "cuda" if USE_CUDA else "cpu"))
+    print("%-5s %5s %4s %3s %11s %9s %9s %9s %9s %9s %9s" % (
+        "model", "H", "b", "thr", "frames/s", "fwd ms", "bwd ms", "step ms", "p50 ms", "p90 ms", "p99 ms"))
+    results = []
+    for n_threads in threads:
+        torch.set_num_threads(n_threads)
+        for name in names:
+            for H in hiddens:
+                for B in batches:
+                    r = throughput(name, H, B)
+                    results.append(r)
+                    line = "%-5s %5d %4d %3d %11.1f %9.2f %9.2f %9.2f %9.2f %9.2f %9.2f" % (
+                        name, H, B, r["threads"], r["frames_per_s"], r["forward_ms"], r["backward_ms"],
+                        r["step_ms"], r["p50_ms"], r["p90_ms"], r["p99_ms"])
+                    if config_key(r) in base:
+                        line += "  x%.2f" % (r["frames_per_s"] / base[config_key(r)]["frames_per_s"])
+                    print(line)
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"commit": git_commit(), "torch": torch.__version__,
+                       "device": "cuda" if USE_CUDA else "cpu", "n_feat": args.n_feat,
+                       "repeat": args.repeat, "seed": args.seed, "results": results}, f, indent=1)
+
+
+np.random.seed(args.seed)
+torch.manual_seed(args.seed)
+
+if args.bench == "loss":
+    for name in args.models.split(','):
+        bench_loss(name)
+elif args.bench == "stream":
+    for name in args.models.split(','):
+        bench_stream(name)
+elif args.bench == "subsample":
+    for name in args.models.split(','):
+        bench_subsample(name)
+elif args.bench == "checkpoint":
+    for name in args.models.split(','):
+        bench_checkpoint(name)
+elif args.bench == "throughput":
+    bench_throughput(list(MODELS) + ["dnn", "dcnn"] if args.models == "all" else args.models.split(','))
@@ -0,0 +1,102 @@
+import argparse
+import os
+from util import *
+from timit import *
+from decode import *
+from models import *
+from loader import *
+from overlap import *
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('data', default='./data/',
+                    help='data folder')
+parser.add_argument('feat', default='mfcc',
+                    help='mfcc or fbank or all')
+parser.add_argument('model', default='brnn',
+                    help='model (brnn or bres)')
+parser.add_argument('model_file', default='brnn.pt',
+                    help='model file')
+parser.add_argument('-wx', '--window_size_x', type=int, default=int(3))
+parser.add_argument('-wy', '--window_size_y', type=int, default=int(2))
+parser.add_argument('-p', '--pool_size', type=int, default=int(2))
+parser.add_argument('-H', '--hidden_size', type=int, default=int(20))
+parser.add_argument('-b', '--batch_size', type=int, default=int(32))
+parser.add_argument('-n', '--n_layers', type=int, default=int(1))
+parser.add_argument('-d', '--dropout', type=float, default=int(0.0))
+parser.add_argument('-N', '--norm', type=str, default='frame',
+                    help='frame or utt or global or none')
+parser.add_argument('-r', '--repeat', type=int, default=int(3))
+parser.add_argument('-c', '--chunks', type=str, default='50,100,200,400',
+                    help='comma separated chunk lengths')
+parser.add_argument('--left', type=int, default=int(50))
+parser.add_argument('--right', type=int, default=int(50))
+parser.add_argument('--seed', type=int, default=int(0),
+                    help='the seed train.py was given (train.py --seed), so the validation utterances were held out')
+args = parser.parse_args()
+
+
+random.seed(args.seed)
+timit = TIMIT(args.data, "tr", args.feat, args.norm)
+model = build_model(args.model, timit.N_FEAT, timit.N_LABEL, args.hidden_size, args.batch_size,
+                    args.n_layers, args.dropout, (args.window_size_x, args.window_size_y),
+                    args.pool_size)
+state_dict = torch.load(os.path.join("models", args.model_file), map_location=lambda storage, location: storage)
+model.load_state_dict(state_dict)
+model = model.eval()
+if USE_CUDA:
+    model.cuda()
+
+codes = char_codes(timit.id2ascii, timit.N_LABEL)
+SIL = codes[timit.lab2id['sil']]
+
+# the validation batches, collated once (copied out of the reused buffers)
+loader = Prefetcher(timit, args.batch_size)
+batches = [(input.clone(), target.data.cpu().numpy().copy(), list(lens))
+           for input, target, ids, useful, lens in
+           loader(seq_batches(len(timit.valid_set), args.batch_size), "va")]
+n_frames = sum(sum(lens) for input, ys, lens in batches)
+labels = [ys[i, :lens[i]] for input, ys, lens in batches for i in range(len(lens))]
+refs = [trim(codes[ys], SIL, 1) for ys in labels]
+
+
+def run(chunk):
+    res = []
+    with torch.no_grad():
+        for input, ys, lens in batches:
+            if chunk > 0:
+                output = overlap_forward(model, input, lens, chunk, args.left, args.right)
+            else:
+                output, hidden = model(input, model.init_hidden(len(lens)), lens)
+            out = output.max(2)[1].data.cpu().numpy()
+            res += [out[i, :lens[i]] for i in range(len(lens))]
+    return res
+
+
+def timed(chunk):
+    best = None
+    res = None
+    for _ in range(args.repeat):
+        start = time.time()
+        res = run(chunk)
+        t = time.time() - start
+        best = t if best is None else min(best, t)
+    return best, res
+
+
+def score(hyps):
+    acc = np.mean(np.concatenate([h == ys for h, ys in zip(hyps, labels)]))
+    dist = edit_distances([trim(codes[h], SIL) for h in hyps], refs).mean()
+    return acc, dist
+
+
+t_full, full = timed(0)
+acc_full, dist_full = score(full)
+print("%s: %d validation utterances, %d frames, left %d right %d" % (
+    args.model_file, len(full), n_frames, args.left, args.right))
+print("  full      %8.3fs  acc %.4f  edit distance %.3f" % (t_full, acc_full, dist_full))
+for chunk in [int(c) for c in args.chunks.split(',')]:
+    t, hyps = timed(chunk)
+    acc, dist = score(hyps)
+    same = np.mean(np.concatenate([h == f for h, f in zip(hyps, full)]))
+    print("  chunk %3d %8.3fs  x%.2f  acc %.4f (%+.4f)  edit distance %.3f (%+.3f)  same labels %.4f" % (
+        chunk, t, t_full / t, acc, acc - acc_full, dist, dist - dist_full, same))
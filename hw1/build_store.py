@@ -0,0 +1,43 @@
+import argparse
+import os
+from util import *
+from store import *
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('data', default='./data/',
+                    help='data folder')
+parser.add_argument('feat', default='mfcc',
+                    help='mfcc or fbank or all')
+parser.add_argument('-s', '--split', type=str, default='both',
+                    help='train or test or both')
+parser.add_argument('-N', '--norm', type=str, default='frame',
+                    help='frame or utt or global or none')
+parser.add_argument('-j', '--jobs', type=int, default=int(1),
+                    help='processes for parsing the ark files')
+parser.add_argument('-S', '--source', type=str, default='text',
+                    help='text (.ark dumps) or kaldi (binary .ark/.scp)')
+args = parser.parse_args()
+
+
+lab2id, id2ascii = make_lab2id(
+    os.path.join(args.data, "48phone_char.map"),
+    os.path.join(args.data, "phones", "48_39.map"))
+
+start = time.time()
+stats = None
+if args.norm == "global":
+    stats = global_cmvn(args.data, args.feat, args.jobs, args.source)
+if args.split in ("train", "both"):
+    y = read_labels(os.path.join(args.data, "label", "train.lab"), lab2id)
+    pairs = iter_data(ark_files(args.data, args.feat, "train", args.source), y,
+                      args.norm, stats,
+                      args.jobs, args.source)
+    build_store(pairs, store_dir(args.data, args.feat, "train", args.norm),
+                sources=store_sources(args.data, args.feat, "train", args.norm, args.source))
+if args.split in ("test", "both"):
+    pairs = iter_data(ark_files(args.data, args.feat, "test", args.source), None,
+                      args.norm, stats,
+                      args.jobs, args.source)
+    build_store(pairs, store_dir(args.data, args.feat, "test", args.norm),
+                sources=store_sources(args.data, args.feat, "test", args.norm, args.source))
+print("done in %s" % time_since(start))
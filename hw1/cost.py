@@ -0,0 +1,196 @@
+import argparse
+import multiprocessing
+import torch
+import torch.nn as nn
+from torch.autograd import Variable
+from torch.nn.utils.rnn import PackedSequence
+from util import *
+from models import *
+import model_dnn
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('-m', '--models', type=str, default='rnn,brnn,cnn,bcnn,res,bres,dnn',
+                    help='comma separated models')
+parser.add_argument('-f', '--n_feat', type=int, default=int(39),
+                    help='39 (mfcc) or 69 (fbank) or 108 (all)')
+parser.add_argument('-wx', '--window_size_x', type=int, default=int(3))
+parser.add_argument('-wy', '--window_size_y', type=int, default=int(2))
+parser.add_argument('-p', '--pool_size', type=int, default=int(2))
+parser.add_argument('--frame_size', type=int, default=int(17),
+                    help='frames per dnn input window')
+parser.add_argument('-H', '--hidden_size', type=int, default=int(100))
+parser.add_argument('-n', '--n_layers', type=int, default=int(2))
+parser.add_argument('--batches', type=str, default='4,8,16,32',
+                    help='comma separated batch sizes')
+parser.add_argument('-T', '--frames', type=int, default=int(780),
+                    help='frames per utterance (780: the longest in TIMIT)')
+parser.add_argument('--mem', type=float, default=float(8192),
+                    help='memory budget (MB) for the largest batch')
+parser.add_argument('--check', action='store_true',
+                    help='also run a real training step and measure its memory peak')
+args = parser.parse_args()
+
+N_LABEL = 39 + 1
+PROBE = (2, 64)
+
+# Cost of one training step (Adam) as a function of batch x frames, from a
+# small probe step. FLOPs are 2 x the multiply-adds of the conv, linear and
+# recurrent layers (elementwise ops, pooling and BatchNorm are left out),
+# backward is taken as 2 x forward. Activation memory is what autograd
+# saves for backward, which grows with batch x frames; weights, gradients
+# and the two Adam moments are 4 x the parameters on top.
+
+
+def rnn_flops(m, input):
+    # per step and direction: g gates of (in + H) x H
+    g = {nn.LSTM: 4, nn.GRU: 3}.get(type(m), 1)
+    x = input[0]
+    steps = x.data.size(0) if isinstance(x, PackedSequence) else x.size(0) * x.size(1)
+    n_dir = 2 if m.bidirectional else 1
+    f = 0
+    for k in range(m.num_layers):
+        size = m.input_size if k == 0 else m.hidden_size * n_dir
+        f += n_dir * g * m.hidden_size * (size + m.hidden_size)
+    return 2 * f * steps
+
+
+def module_flops(m, input, output):
+    if isinstance(m, nn.Linear):
+        return 2 * m.in_features * output.numel()
+    if isinstance(m, nn.Conv2d):
+        kh, kw = m.kernel_size
+        return 2 * m.in_channels // m.groups * kh * kw * output.numel()
+    if isinstance(m, (nn.LSTM, nn.GRU, nn.RNN)):
+        return rnn_flops(m, input)
+    return 0
+
+
+def build(name, B, T):
+    if name == "dnn":
+        # one window of frame_size frames per output frame
+        return model_dnn.DNN(args.n_feat, args.frame_size, args.hidden_size, N_LABEL, B * T)
+    return build_model(name, args.n_feat, N_LABEL, args.hidden_size, B, args.n_layers,
+                       window_size=(args.window_size_x, args.window_size_y), pool_size=args.pool_size)
+
+
+def train_step(name, model, B, T):
+    # returns a closure for forward + backward + Adam on random data
+    if name == "dnn":
+        x = torch.randn(B * T, args.frame_size, args.n_feat)
+        y = torch.LongTensor(B * T).random_(1, N_LABEL)
+    else:
+        x = torch.randn(B, T, args.n_feat)
+        y = torch.LongTensor(B, T).random_(1, N_LABEL)
+    x, y = Variable(x), Variable(y)
+    if USE_CUDA:
+        x, y = x.cuda(), y.cuda()
+    lens = [T] * B
+    opt = torch.optim.Adam(model.parameters())
+
+    def forward():
+        if name == "dnn":
+            return F.cross_entropy(model(x), y)
+        output, hidden = model(x, model.init_hidden(B), lens)
+        return masked_ce(output, y, lens).sum()
+
+    def step():
+        opt.zero_grad()
+        forward().backward()
+        opt.step()
+
+    return forward, step
+
+
+def probe(name):
+    # (parameters, forward FLOPs per frame, saved bytes per frame)
+    B, T = PROBE
+    model = build(name, B, T)
+    if USE_CUDA:
+        model.cuda()
+    model.train()
+    forward, step = train_step(name, model, B, T)
+    params = set(p.data_ptr() for p in model.parameters())
+
+    flops = [0]
+
+    def count(m, input, output):
+        flops[0] += module_flops(m, input, output)
+
+    hooks = [m.register_forward_hook(count) for m in model.modules() if len(list(m.children())) == 0]
+    seen = {}
+
+    def pack(t):
+        if t.data_ptr() not in params:
+            seen[t.untyped_storage().data_ptr()] = t.untyped_storage().nbytes()
+        return t
+
+    with torch.autograd.graph.saved_tensors_hooks(pack, lambda t: t):
+        loss = forward()
+    loss.backward()
+    for h in hooks:
+        h.remove()
+    n_params = sum(p.numel() for p in model.parameters())
+    return n_params, flops[0] / (B * T), sum(seen.values()) / (B * T)
+
+
+def step_mb(name, B, T, queue=None):
+    # memory peak of a real training step, from nothing allocated: the
+    # allocator's on GPU, the growth of the peak RSS on CPU (Linux)
+    if USE_CUDA:
+        torch.cuda.empty_cache()
+        base = torch.cuda.memory_allocated()
+        torch.cuda.reset_peak_memory_stats()
+    else:
+        base = rss_mb()
+    model = build(name, B, T)
+    if USE_CUDA:
+        model.cuda()
+    model.train()
+    forward, step = train_step(name, model, B, T)
+    step()
+    if USE_CUDA:
+        torch.cuda.synchronize()
+        return (torch.cuda.max_memory_allocated() - base) / 2 ** 20
+    queue.put(peak_rss_mb() - base)
+
+
+def measured_mb(name, B, T):
+    if USE_CUDA:
+        return step_mb(name, B, T)
+    # the peak RSS only goes up, so every step runs in a fresh fork
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    p = ctx.Process(target=step_mb, args=(name, B, T, queue))
+    p.start()
+    res = queue.get()
+    p.join()
+    return res
+
+
+T = args.frames
+batches = [int(b) for b in args.batches.split(',')]
+print("f%d h%d l%d, %d frames per utterance, %s MB budget%s" % (
+    args.n_feat, args.hidden_size, args.n_layers, T, args.mem,
+    "" if not args.check else ", measured: %s" % ("allocator peak" if USE_CUDA else "peak RSS growth")))
+for name in args.models.split(','):
+    n_params, flops, act = probe(name)
+    states = 4 * 4 * n_params / 2 ** 20
+    largest = largest_batch(batches, [states + act * B * T / 2 ** 20 for B in batches], args.mem)
+    print("%-5s %10d params  %8.2f MFLOPs/frame forward  %8.2f backward  %7.1f KB/frame  largest batch %s (estimate)" % (
+        name, n_params, flops / 1e6, 2 * flops / 1e6, act / 2 ** 10, batch_str(largest)))
+    ms = []
+    for B in batches:
+        est = states + act * B * T / 2 ** 20
+        line = "  b%-4d %9.2f GFLOPs/step  %9.1f MB" % (B, 3 * flops * B * T / 1e9, est)
+        if args.check:
+            ms.append(measured_mb(name, B, T))
+            line += "  measured %9.1f MB (x%.2f)" % (ms[-1], ms[-1] / est)
+        print(line)
+    if len(ms) > 1:
+        # backward temporaries and allocator slack, linear in the batch too;
+        # peaks that do not grow with the batch fall back to the estimate
+        measured = largest_batch(batches, ms, args.mem)
+        if measured is None:
+            print("  largest batch from the measured peaks: n/a (estimate %s)" % batch_str(largest))
+        else:
+            print("  largest batch from the measured peaks: %d" % measured)
@@ -0,0 +1,200 @@
+import numpy as np
+
+# Post-processing of frame labels into phone strings. Sequences are numpy
+# arrays of character codes (ord of id2ascii), so the result only depends
+# on the characters, exactly like the old string-based trim / trim2.
+
+
+def char_codes(id2ascii, n_label):
+    # table[id] = ord(id2ascii[id])
+    table = np.zeros(n_label, dtype=np.int64)
+    for id, ch in id2ascii.items():
+        table[id] = ord(ch)
+    return table
+
+
+def to_str(codes):
+    return ''.join(map(chr, codes))
+
+
+def runs(codes):
+    # run-length encoding: (first index, length) of every run
+    codes = np.asarray(codes)
+    if len(codes) == 0:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+    starts = np.flatnonzero(np.concatenate([[True], codes[1:] != codes[:-1]]))
+    return starts, np.diff(np.append(starts, len(codes)))
+
+
+def trim(codes, sil, min_run=3):
+    # keep runs of at least min_run frames, then drop a leading and a
+    # trailing silence
+    codes = np.asarray(codes)
+    starts, lens = runs(codes)
+    res = codes[starts[lens >= min_run]]
+    if len(res) <= 1:
+        return res
+    if res[0] == sil:
+        res = res[1:]
+    if len(res) > 0 and res[-1] == sil:
+        res = res[:-1]
+    return res
+
+
+def trim2(codes, sil, frame=6):
+    # majority label of every frame-wide sliding window (ties go to the label
+    # seen first in the window, as Counter.most_common does), then collapse
+    # repeats and drop silence
+    codes = np.asarray(codes)
+    n = len(codes) - frame + 1
+    if n <= 0:
+        return codes[:0]
+    vals, inv = np.unique(codes, return_inverse=True)
+    onehot = np.zeros((len(codes) + 1, len(vals)), dtype=np.int32)
+    onehot[np.arange(1, len(codes) + 1), inv] = 1
+    cum = np.cumsum(onehot, axis=0)
+    counts = cum[frame:] - cum[:-frame]
+
+    rows = np.arange(n)[:, None]
+    win = inv[rows + np.arange(frame)]
+    cnt = counts[rows, win]
+    first = np.argmax(cnt == cnt.max(1, keepdims=True), axis=1)
+    mode = vals[win[np.arange(n), first]]
+
+    prev = np.concatenate([[-1], mode[:-1]])
+    return mode[(mode != prev) & (mode != sil)]
+
+
+def post_process(labels, codes, sil, method="trim", min_run=3, frame=6):
+    # frame label ids of one utterance -> phone string
+    seq = codes[labels]
+    if method == "trim2":
+        return to_str(trim2(seq, sil, frame))
+    return to_str(trim(seq, sil, min_run))
+
+
+def edit_distances(hyps, refs):
+    # Levenshtein distance of every (hyp, ref) pair, all pairs at once: one
+    # DP row per hyp element over a padded (pairs x longest ref) matrix. The
+    # insertions along a row are a running minimum of (row - j) + j.
+    n = len(hyps)
+    la = np.array([len(h) for h in hyps], dtype=np.int64)
+    lb = np.array([len(r) for r in refs], dtype=np.int64)
+    if n == 0:
+        return np.zeros(0, dtype=np.int64)
+    a = np.full((n, max(la.max(), 1)), -1, dtype=np.int64)
+    b = np.full((n, max(lb.max(), 1)), -2, dtype=np.int64)
+    for k in range(n):
+        a[k, :la[k]] = hyps[k]
+        b[k, :lb[k]] = refs[k]
+
+    j = np.arange(b.shape[1] + 1)
+    row = np.tile(j, (n, 1))
+    for i in range(la.max()):
+        new = np.empty_like(row)
+        new[:, 0] = i + 1
+        new[:, 1:] = np.minimum(row[:, 1:] + 1, row[:, :-1] + (b != a[:, i:i + 1]))
+        new = np.minimum.accumulate(new - j, axis=1) + j
+        live = i < la
+        row[live] = new[live]
+    return row[np.arange(n), lb]
+
+
+def edit_distance(a, b):
+    return int(edit_distances([a], [b])[0])
+
+
+# Viterbi over frame log-posteriors. Every label k is a chain of min_dur
+# states: a frame can only leave label k from the last state of its chain,
+# so every phone lasts at least min_dur frames. log_trans[j, k] is the log
+# probability of going from label j to label k (the diagonal is the self
+# loop on the last state). A whole padded batch is decoded at once.
+
+
+def uniform_transitions(n_label, self_loop=0.9):
+    # stay with self_loop, otherwise move to any other label
+    trans = np.full((n_label, n_label), (1 - self_loop) / max(n_label - 1, 1))
+    np.fill_diagonal(trans, self_loop)
+    return np.log(trans)
+
+
+def estimate_transitions(label_seqs, n_label, smooth=1.0):
+    # frame label bigrams of the training set, add-smooth counts
+    counts = np.full((n_label, n_label), smooth)
+    for ys in label_seqs:
+        ys = np.asarray(ys)
+        np.add.at(counts, (ys[:-1], ys[1:]), 1)
+    return np.log(counts / counts.sum(1, keepdims=True))
+
+
+def viterbi(log_post, lens, log_trans, min_dur=1):
+    # log_post: (B x T x K) frame log-posteriors, lens: (B) real lengths
+    # returns (B x T) best label of every frame (past lens[b] is garbage)
+    B, T, K = log_post.shape
+    D = max(1, min_dur)
+    lens = np.asarray(lens)
+    log_post = np.asarray(log_post, dtype=np.float64)
+    enter = np.array(log_trans, dtype=np.float64)
+    stay = np.diag(enter).copy()
+    np.fill_diagonal(enter, -np.inf)
+
+    # delta: (B x K x D) best score ending in state d of label k
+    delta = np.full((B, K, D), -np.inf)
+    delta[:, :, 0] = log_post[:, 0]
+    # back pointers: label we came from when entering a chain, and whether
+    # the last state looped on itself
+    from_k = np.zeros((T, B, K), dtype=np.int32)
+    looped = np.zeros((T, B, K), dtype=bool)
+    for t in range(1, T):
+        last = delta[:, :, D - 1]
+        cand = last[:, :, None] + enter[None]
+        from_k[t] = cand.argmax(1)
+        new = np.empty_like(delta)
+        new[:, :, 0] = cand.max(1)
+        new[:, :, 1:] = delta[:, :, :-1]
+        loop = last + stay[None]
+        if D == 1:
+            looped[t] = loop >= new[:, :, 0]
+            new[:, :, 0] = np.maximum(new[:, :, 0], loop)
+        else:
+            looped[t] = loop >= new[:, :, D - 1]
+            new[:, :, D - 1] = np.maximum(new[:, :, D - 1], loop)
+        new += log_post[:, t, :, None]
+        live = t < lens
+        delta[live] = new[live]
+
+    # end on the last state of a chain; an utterance shorter than the
+    # minimum duration ends wherever it can
+    end = delta[:, :, D - 1].copy()
+    short = np.isinf(end.max(1))
+    end[short] = delta[short].max(2)
+    k = end.argmax(1)
+    d = np.where(short, delta[np.arange(B), k].argmax(1), D - 1)
+
+    path = np.zeros((B, T), dtype=np.int64)
+    rows = np.arange(B)
+    for t in range(T - 1, -1, -1):
+        live = t < lens
+        path[live, t] = k[live]
+        if t == 0:
+            break
+        # step back one frame: loop on the last state, move down the chain,
+        # or come from the last state of another label
+        lp = looped[t, rows, k] & (d == D - 1)
+        inner = ~lp & (d > 0)
+        entry = ~lp & (d == 0)
+        nk = np.where(entry, from_k[t, rows, k], k)
+        nd = np.where(entry, D - 1, np.where(inner, d - 1, d))
+        k = np.where(live, nk, k)
+        d = np.where(live, nd, d)
+    return path
+
+
+def viterbi_decode(log_posts, codes, sil, log_trans, min_dur=1):
+    # [(len x K) log-posteriors] -> [phone string], one padded batch
+    lens = np.array([len(lp) for lp in log_posts])
+    batch = np.zeros((len(log_posts), lens.max(), log_posts[0].shape[1]))
+    for i, lp in enumerate(log_posts):
+        batch[i, :len(lp)] = lp
+    path = viterbi(batch, lens, log_trans, min_dur)
+    return [to_str(trim(codes[path[i, :l]], sil, 1)) for i, l in enumerate(lens)]
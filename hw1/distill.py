@@ -0,0 +1,47 @@
+import os
+import torch
+import numpy as np
+from util import *
+from store import *
+from loader import Prefetcher, seq_batches
+
+# Teacher logits for distillation. They are either computed on every batch
+# by the frozen teacher, or once for every training utterance into a
+# float16 store (same layout as the feature stores, one row per frame)
+# that later epochs read by utterance id. The cache is keyed by utterance
+# id only, so the teacher may use other features than the student; it is
+# fingerprinted with the teacher checkpoint and the teacher's arks / cmvn.
+
+
+def teacher_cache_dir(data_folder, model_file, feat, norm="frame"):
+    return os.path.join(data_folder, "store", "teacher.%s.%s.%s" % (
+        os.path.basename(model_file)[:-len(".pt")], feat, norm))
+
+
+def teacher_logits(teacher, timit, batch_size):
+    # (float16 logits, id) of every utterance of timit.tr_set and valid_set
+    loader = Prefetcher(timit, batch_size)
+    for type, n in (("tr", len(timit.tr_set)), ("va", len(timit.valid_set))):
+        for input, target, ids, useful, lens in loader(seq_batches(n, batch_size), type):
+            with torch.no_grad():
+                output, hidden = teacher(input, teacher.init_hidden(len(lens)), lens)
+            output = output.data.cpu().numpy().astype(np.float16)
+            for i in range(useful):
+                yield output[i, :lens[i]], ids[i]
+
+
+class TeacherCache():
+    def __init__(self, path):
+        self.store = FeatureStore(path, np.float16)
+        self.row = dict((id, i) for i, id in enumerate(self.store.ids))
+
+    def batch(self, ids, max_len):
+        # (batch x max_len x n_label) teacher logits, zero padded
+        res = np.zeros((len(ids), max_len, self.store.n_feat), dtype=np.float32)
+        for i, id in enumerate(ids):
+            xs = self.store[self.row[id]][0]
+            res[i, :len(xs)] = xs
+        res = torch.from_numpy(res)
+        if USE_CUDA:
+            res = res.cuda()
+        return res
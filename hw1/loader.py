@@ -0,0 +1,63 @@
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from util import *
+
+
+class Prefetcher():
+    # get_batch_idx + collate for a list of index batches, with the next
+    # n_ahead batches prepared in worker threads (the numpy copies release
+    # the GIL). Batches come out in the order they were asked for, so a
+    # seeded run sees the same batches as the serial loop; n_ahead=0 is
+    # the serial loop. Each batch in flight has its own Collator buffer.
+    def __init__(self, timit, batch_size, n_ahead=0, n_workers=1, pin_memory=True):
+        self.timit = timit
+        self.batch_size = batch_size
+        self.n_ahead = n_ahead
+        self.n_workers = max(1, n_workers)
+        # +2: the batch being used and the one before it, whose host buffer
+        # may still feed an asynchronous copy to the GPU
+        self.collators = [Collator(timit.N_FEAT, pin_memory) for _ in range(n_ahead + 2)]
+        # time the consumer spent waiting for batches
+        self.wait_time = 0
+
+    def make(self, k, idxs, type):
+        collate = self.collators[k % len(self.collators)]
+        if type == "te":
+            xss, ids, useful = self.timit.get_batch_idx(idxs, type)
+            xss, ids, lens = collate(xss, None, ids)
+            return xss, ids, useful, lens
+        xss, yss, ids, useful = self.timit.get_batch_idx(idxs, type)
+        xss, yss, ids, lens = collate(xss, yss, ids)
+        return xss, yss, ids, useful, lens
+
+    def __call__(self, batches, type="tr"):
+        # tr / va: yields (inputs, targets, ids, useful, lens)
+        # te: yields (inputs, ids, useful, lens)
+        if self.n_ahead == 0:
+            for k, idxs in enumerate(batches):
+                start = time.time()
+                res = self.make(k, idxs, type)
+                self.wait_time += time.time() - start
+                yield res
+            return
+
+        with ThreadPoolExecutor(self.n_workers) as ex:
+            todo = enumerate(batches)
+            pending = deque()
+            for k, idxs in todo:
+                pending.append(ex.submit(self.make, k, idxs, type))
+                if len(pending) == self.n_ahead:
+                    break
+            while pending:
+                start = time.time()
+                res = pending.popleft().result()
+                self.wait_time += time.time() - start
+                for k, idxs in todo:
+                    pending.append(ex.submit(self.make, k, idxs, type))
+                    break
+                yield res
+
+
+def seq_batches(n, batch_size):
+    return [range(i, min(i + batch_size, n)) for i in range(0, n, batch_size)]
@@ -44,9 +44,10 @@ class BCNN(nn.Module):
 
     def forward(self, input, hc, lens):
         # input: (batch x maxlen x feat)
-        input = self.conv(input.view(self.batch_size, 1, -1, self.input_size))
+        batch_size = input.size(0)
+        input = self.conv(input.view(batch_size, 1, -1, self.input_size))
         # input: (batch, 1, maxlen, feat - window[1] + 1)
-        input = input.view(self.batch_size, -1, self.input_size - self.window_size[1] + 1)
+        input = input.view(batch_size, -1, self.input_size - self.window_size[1] + 1)
         # input: (batch, maxlen, feat - window[1] + 1)
         input = self.pool(input)
         # input: (batch, maxlen, (feat - window[1] + 1) / pool_size)
@@ -65,9 +66,11 @@ class BCNN(nn.Module):
 
         return output, hc
 
-    def init_hidden(self):
-        h0 = Variable(torch.zeros(self.n_layers * 2, self.batch_size, self.hidden_size))
-        c0 = Variable(torch.zeros(self.n_layers * 2, self.batch_size, self.hidden_size))
+    def init_hidden(self, batch_size=None):
+        # batch_size defaults to the one the model was built with
+        batch_size = batch_size or self.batch_size
+        h0 = Variable(torch.zeros(self.n_layers * 2, batch_size, self.hidden_size))
+        c0 = Variable(torch.zeros(self.n_layers * 2, batch_size, self.hidden_size))
         if USE_CUDA:
             h0, c0 = h0.cuda(), c0.cuda()
         return (h0, c0)
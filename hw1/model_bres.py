@@ -4,6 +4,7 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from util import *
+from recompute import *
 
 class RES(nn.Module):
     def __init__(self, in_ch, out_ch, kernel_size, n_layers):
@@ -29,7 +30,15 @@ class RES(nn.Module):
         if in_ch != out_ch:
             self.proj = nn.Conv2d(in_ch, out_ch, kernel_size=1, stride=1)
 
+        # recompute the activations in backward instead of keeping them
+        self.checkpoint = False
+
     def forward(self, input):
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return recompute(self, self.block, input)
+        return self.block(input)
+
+    def block(self, input):
         resi = input
         input = self.conv1(input)
         input = self.bn1(input)
@@ -50,7 +59,8 @@ class BRESR(nn.Module):
                  output_size,
                  batch_size,
                  n_layers,
-                 dropout
+                 dropout,
+                 checkpoint=()
                  ):
         super(BRESR, self).__init__()
         self.input_size = input_size
@@ -73,6 +83,7 @@ class BRESR(nn.Module):
         self.res2 = RES(16, 8, 3, 2)
         self.res3 = RES(8, 4, 3, 2)
         self.res4 = RES(4, 2, 3, 2)
+        set_checkpoint(self, checkpoint)
 
         self.W = nn.Linear(2 * self.hidden_size, self.output_size)
 
@@ -103,9 +114,11 @@ class BRESR(nn.Module):
 
         return output, hc
 
-    def init_hidden(self):
-        h0 = Variable(torch.zeros(self.n_layers * 2, self.batch_size, self.hidden_size))
-        c0 = Variable(torch.zeros(self.n_layers * 2, self.batch_size, self.hidden_size))
+    def init_hidden(self, batch_size=None):
+        # batch_size defaults to the one the model was built with
+        batch_size = batch_size or self.batch_size
+        h0 = Variable(torch.zeros(self.n_layers * 2, batch_size, self.hidden_size))
+        c0 = Variable(torch.zeros(self.n_layers * 2, batch_size, self.hidden_size))
         if USE_CUDA:
             h0, c0 = h0.cuda(), c0.cuda()
         return (h0, c0)
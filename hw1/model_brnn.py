@@ -4,6 +4,7 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from util import *
+from subsample import *
 
 class BRNN(nn.Module):
     def __init__(self,
@@ -12,7 +13,9 @@ class BRNN(nn.Module):
                  output_size,
                  batch_size,
                  n_layers=1,
-                 dropout=0.0
+                 dropout=0.0,
+                 subsample=1,
+                 sub_mode="stack"
                  ):
         super(BRNN, self).__init__()
         self.input_size = input_size
@@ -21,33 +24,41 @@ class BRNN(nn.Module):
         self.batch_size = batch_size
         self.n_layers = n_layers
         self.dropout = dropout
+        self.subsample = subsample
+        self.sub_mode = sub_mode
 
-        self.lstm = nn.LSTM(input_size,
-                            hidden_size,
-                            n_layers,
-                            batch_first=True,
-                            dropout=self.dropout,
-                            bidirectional=True)
+        self.lstm = make_rnn(nn.LSTM,
+                             input_size,
+                             hidden_size,
+                             n_layers,
+                             dropout=self.dropout,
+                             bidirectional=True,
+                             k=subsample,
+                             mode=sub_mode)
         self.decoderlr = nn.Linear(hidden_size, output_size)
         self.decoderrl = nn.Linear(hidden_size, output_size)
 
     def forward(self, input, hc, lens):
         # input: (batch x maxlen x feat)
-        input_p = pack_padded_sequence(input, lens, batch_first=True)
-        output_p, hc = self.lstm(input_p, hc)
-        output, _ = pad_packed_sequence(output_p, batch_first=True)
+        maxlen = input.size(1)
+        input, lens = front_end(input, lens, self.subsample, self.sub_mode)
+        output, hc = run_rnn(self.lstm, input, hc, lens)
 
         outputlr = self.decoderlr(output[:,:,:self.hidden_size])
 
         outputrl = self.decoderrl(output[:,:,self.hidden_size:])
 
         output = outputlr + outputrl
+        # back to one output per frame
+        output = upsample(output, self.subsample, maxlen)
 
         return output, hc
 
-    def init_hidden(self):
-        h0 = Variable(torch.zeros(self.n_layers * 2, self.batch_size, self.hidden_size))
-        c0 = Variable(torch.zeros(self.n_layers * 2, self.batch_size, self.hidden_size))
+    def init_hidden(self, batch_size=None):
+        # batch_size defaults to the one the model was built with
+        batch_size = batch_size or self.batch_size
+        h0 = Variable(torch.zeros(self.n_layers * 2, batch_size, self.hidden_size))
+        c0 = Variable(torch.zeros(self.n_layers * 2, batch_size, self.hidden_size))
         if USE_CUDA:
             h0, c0 = h0.cuda(), c0.cuda()
         return (h0, c0)
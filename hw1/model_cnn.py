@@ -4,6 +4,7 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from util import *
+from subsample import *
 
 class CNN(nn.Module):
     def __init__(self,
@@ -14,7 +15,9 @@ class CNN(nn.Module):
                  output_size,
                  batch_size,
                  n_layers=1,
-                 dropout=0.0
+                 dropout=0.0,
+                 subsample=1,
+                 sub_mode="stack"
                  ):
         super(CNN, self).__init__()
         self.input_size = input_size
@@ -25,6 +28,8 @@ class CNN(nn.Module):
         self.batch_size = batch_size
         self.n_layers = n_layers
         self.dropout = dropout
+        self.subsample = subsample
+        self.sub_mode = sub_mode
 
         self.conv = nn.Conv2d(1, 1,
                               window_size,
@@ -32,36 +37,43 @@ class CNN(nn.Module):
         self.pool = nn.MaxPool1d(pool_size)
         self.relu = nn.ReLU()
 
-        self.lstm = nn.LSTM((input_size - window_size[1] + 1) // pool_size,
-                            hidden_size,
-                            n_layers,
-                            batch_first=True,
-                            dropout=self.dropout)
+        self.lstm = make_rnn(nn.LSTM,
+                             (input_size - window_size[1] + 1) // pool_size,
+                             hidden_size,
+                             n_layers,
+                             dropout=self.dropout,
+                             k=subsample,
+                             mode=sub_mode)
 
         self.decoder = nn.Linear(hidden_size, output_size)
 
     def forward(self, input, hc, lens):
         # input: (batch x maxlen x feat)
-        input = self.conv(input.view(self.batch_size, 1, -1, self.input_size))
+        batch_size = input.size(0)
+        maxlen = input.size(1)
+        input = self.conv(input.view(batch_size, 1, -1, self.input_size))
         # input: (batch, 1, maxlen, feat - window[1] + 1)
-        input = input.view(self.batch_size, -1, self.input_size - self.window_size[1] + 1)
+        input = input.view(batch_size, -1, self.input_size - self.window_size[1] + 1)
         # input: (batch, maxlen, feat - window[1] + 1)
         input = self.pool(input)
         # input: (batch, maxlen, (feat - window[1] + 1) / pool_size)
         input = self.relu(input)
         # input: (batch, maxlen, (feat - window[1] + 1) / pool_size)
 
-        input_p = pack_padded_sequence(input, lens, batch_first=True)
-        output_p, hc = self.lstm(input_p, hc)
-        output, _ = pad_packed_sequence(output_p, batch_first=True)
+        input, lens = front_end(input, lens, self.subsample, self.sub_mode)
+        output, hc = run_rnn(self.lstm, input, hc, lens)
 
         output = self.decoder(output)
+        # back to one output per frame
+        output = upsample(output, self.subsample, maxlen)
 
         return output, hc
 
-    def init_hidden(self):
-        h0 = Variable(torch.zeros(self.n_layers, self.batch_size, self.hidden_size))
-        c0 = Variable(torch.zeros(self.n_layers, self.batch_size, self.hidden_size))
+    def init_hidden(self, batch_size=None):
+        # batch_size defaults to the one the model was built with
+        batch_size = batch_size or self.batch_size
+        h0 = Variable(torch.zeros(self.n_layers, batch_size, self.hidden_size))
+        c0 = Variable(torch.zeros(self.n_layers, batch_size, self.hidden_size))
         if USE_CUDA:
             h0, c0 = h0.cuda(), c0.cuda()
         return (h0, c0)
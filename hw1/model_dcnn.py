@@ -24,10 +24,7 @@ class CNN(nn.Module):
         self.dropout = dropout
 
         self.encoder = nn.Linear(input_size * frame_size, hidden_size)
-        if USE_CUDA:
-            self.Ws = [nn.Linear(hidden_size, hidden_size).cuda() for _ in range(n_layers)]
-        else:
-            self.Ws = [nn.Linear(hidden_size, hidden_size) for _ in range(n_layers)]
+        self.Ws = nn.ModuleList([nn.Linear(hidden_size, hidden_size) for _ in range(n_layers)])
         self.decoder = nn.Linear(hidden_size, output_size)
         # self.softmax = nn.Softmax()
 
@@ -4,6 +4,8 @@ from torch.autograd import Variable
 import torch.nn.functional as F
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 from util import *
+from recompute import *
+from subsample import *
 
 class RES(nn.Module):
     def __init__(self, in_ch, out_ch, kernel_size, n_layers):
@@ -29,7 +31,15 @@ class RES(nn.Module):
         if in_ch != out_ch:
             self.proj = nn.Conv2d(in_ch, out_ch, kernel_size=1, stride=1)
 
+        # recompute the activations in backward instead of keeping them
+        self.checkpoint = False
+
     def forward(self, input):
+        if self.checkpoint and self.training and torch.is_grad_enabled():
+            return recompute(self, self.block, input)
+        return self.block(input)
+
+    def block(self, input):
         resi = input
         input = self.conv1(input)
         input = self.bn1(input)
@@ -50,7 +60,10 @@ class RESR(nn.Module):
                  output_size,
                  batch_size,
                  n_layers,
-                 dropout
+                 dropout,
+                 subsample=1,
+                 sub_mode="stack",
+                 checkpoint=()
                  ):
         super(RESR, self).__init__()
         self.input_size = input_size
@@ -59,25 +72,30 @@ class RESR(nn.Module):
         self.output_size = output_size
         self.batch_size = batch_size
         self.dropout = dropout
+        self.subsample = subsample
+        self.sub_mode = sub_mode
 
-        self.rnn = nn.RNN(input_size,
-                          hidden_size,
-                          n_layers,
-                          batch_first=True,
-                          dropout=self.dropout)
+        self.rnn = make_rnn(nn.RNN,
+                            input_size,
+                            hidden_size,
+                            n_layers,
+                            dropout=self.dropout,
+                            k=subsample,
+                            mode=sub_mode)
 
         self.res1 = RES(1, 16, 3, 6)
         self.res2 = RES(16, 8, 3, 2)
         self.res3 = RES(8, 4, 3, 2)
         self.res4 = RES(4, 2, 3, 2)
+        set_checkpoint(self, checkpoint)
 
         self.W = nn.Linear(2 * self.hidden_size, self.output_size)
 
     def forward(self, input, hc, lens):
         # input: (batch x maxlen x feat)
-        input_p = pack_padded_sequence(input, lens, batch_first=True)
-        output_p, hc = self.rnn(input_p, hc)
-        output, _ = pad_packed_sequence(output_p, batch_first=True)
+        maxlen = input.size(1)
+        input, lens = front_end(input, lens, self.subsample, self.sub_mode)
+        output, hc = run_rnn(self.rnn, input, hc, lens)
         # output: (batch x maxlen x 128)
 
         output = output.unsqueeze(1)
@@ -94,13 +112,16 @@ class RESR(nn.Module):
         output = torch.cat((output[:,0,:,:], output[:,1,:,:]), dim=2)
 
         output = self.W(output)
+        # back to one output per frame
+        output = upsample(output, self.subsample, maxlen)
 
         return output, hc
 
-    def init_hidden(self):
-        h0 = Variable(torch.zeros(self.n_layers, self.batch_size, self.hidden_size))
-        c0 = Variable(torch.zeros(self.n_layers, self.batch_size, self.hidden_size))
+    def init_hidden(self, batch_size=None):
+        # batch_size defaults to the one the model was built with
+        batch_size = batch_size or self.batch_size
+        # nn.RNN only has a hidden state, no cell
+        h0 = Variable(torch.zeros(self.n_layers, batch_size, self.hidden_size))
         if USE_CUDA:
-            h0, c0 = h0.cuda(), c0.cuda()
-        # return h0
-        return (h0, c0)
+            h0 = h0.cuda()
+        return h0
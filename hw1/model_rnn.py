@@ -32,22 +32,25 @@ class RNN(nn.Module):
 
     def forward(self, input, hc, lens):
         # input: (batch x maxlen x feat)
+        batch_size = input.size(0)
         input_p = pack_padded_sequence(input, lens, batch_first=True)
         output_p, hc = self.lstm(input_p, hc)
         output, _ = pad_packed_sequence(output_p, batch_first=True)
 
-        output.contiguous()
+        output = output.contiguous()
 
         output = self.decoder(output.view(-1, self.hidden_size))
         # output = self.softmax(output)
 
-        output = output.view(self.batch_size, -1, self.output_size)
+        output = output.view(batch_size, -1, self.output_size)
 
         return output, hc
 
-    def init_hidden(self):
-        h0 = Variable(torch.zeros(self.n_layers, self.batch_size, self.hidden_size))
-        c0 = Variable(torch.zeros(self.n_layers, self.batch_size, self.hidden_size))
+    def init_hidden(self, batch_size=None):
+        # batch_size defaults to the one the model was built with
+        batch_size = batch_size or self.batch_size
+        h0 = Variable(torch.zeros(self.n_layers, batch_size, self.hidden_size))
+        c0 = Variable(torch.zeros(self.n_layers, batch_size, self.hidden_size))
         if USE_CUDA:
             h0, c0 = h0.cuda(), c0.cuda()
         return (h0, c0)
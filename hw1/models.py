@@ -0,0 +1,32 @@
+import model_rnn
+import model_cnn
+import model_brnn
+import model_bcnn
+import model_res
+import model_bres
+
+MODELS = ("rnn", "brnn", "cnn", "bcnn", "res", "bres")
+
+
+def build_model(name, N_FEAT, N_LABEL, hidden_size, batch_size, n_layers=1, dropout=0.0,
+                window_size=(3, 2), pool_size=2, subsample=1, sub_mode="stack", checkpoint=()):
+    if subsample > 1 and name not in ("brnn", "cnn", "res"):
+        raise ValueError("subsampling is only for brnn, cnn and res")
+    if checkpoint and name not in ("res", "bres"):
+        raise ValueError("checkpointing is only for res and bres")
+    if name == "rnn":
+        return model_rnn.RNN(N_FEAT, hidden_size, N_LABEL, batch_size, n_layers, dropout)
+    elif name == "brnn":
+        return model_brnn.BRNN(N_FEAT, hidden_size, N_LABEL, batch_size, n_layers, dropout,
+                               subsample, sub_mode)
+    elif name == "cnn":
+        return model_cnn.CNN(N_FEAT, window_size, pool_size, hidden_size, N_LABEL, batch_size, n_layers, dropout,
+                             subsample, sub_mode)
+    elif name == "bcnn":
+        return model_bcnn.BCNN(N_FEAT, window_size, pool_size, hidden_size, N_LABEL, batch_size, n_layers, dropout)
+    elif name == "res":
+        return model_res.RESR(N_FEAT, hidden_size, N_LABEL, batch_size, n_layers, dropout,
+                              subsample, sub_mode, checkpoint)
+    elif name == "bres":
+        return model_bres.BRESR(N_FEAT, hidden_size, N_LABEL, batch_size, n_layers, dropout, checkpoint)
+    raise ValueError("unknown model %s" % name)
@@ -0,0 +1,56 @@
+import torch
+import numpy as np
+from util import *
+
+# Overlapped chunk inference for the bidirectional models. Every utterance
+# is cut into chunks of `chunk` frames; each chunk is run with up to `left`
+# frames of context before it and `right` frames after it, all chunks of
+# the batch together as one bigger batch of shorter sequences, and only
+# the outputs of the chunk itself are kept. Utterances no longer than one
+# chunk are run whole, so they come out exactly as before.
+
+
+def overlap_windows(lens, chunk, left, right):
+    # (utterance, window start, window end, chunk start, chunk end) of every
+    # window, longest window first as pack_padded_sequence wants them
+    res = []
+    for b, l in enumerate(lens):
+        for cs in range(0, l, chunk):
+            ce = min(cs + chunk, l)
+            res.append((b, max(0, cs - left), min(l, ce + right), cs, ce))
+    res.sort(key=lambda w: w[1] - w[2])
+    return np.array(res, dtype=np.int64).reshape(-1, 5)
+
+
+def overlap_forward(model, input, lens, chunk, left=50, right=50):
+    # input: (batch x maxlen x feat) -> (batch x maxlen x N_LABEL)
+    B, T, n_feat = input.size()
+    win = overlap_windows(lens, chunk, left, right)
+    wl = win[:, 2] - win[:, 1]
+    W = int(wl.max())
+
+    # gather the windows out of the flat (B*T x feat) input
+    off = np.arange(W)
+    idx = win[:, :1] * T + win[:, 1:2] + off
+    valid = off < wl[:, None]
+    idx = torch.from_numpy(np.where(valid, idx, 0).ravel())
+    mask = torch.from_numpy(valid.astype(np.float32)).unsqueeze(2)
+    if USE_CUDA:
+        idx, mask = idx.cuda(), mask.cuda()
+    x = input.view(B * T, n_feat)[idx].view(len(win), W, n_feat) * mask
+
+    output, hidden = model(x, model.init_hidden(len(win)), wl.tolist())
+
+    # scatter the chunk part of every window back into place
+    n = win[:, 4] - win[:, 3]
+    w_rows = np.repeat(np.arange(len(win)), n)
+    starts = np.repeat(np.cumsum(n) - n, n)
+    steps = np.arange(n.sum()) - starts
+    src = w_rows * output.size(1) + np.repeat(win[:, 3] - win[:, 1], n) + steps
+    dst = np.repeat(win[:, 0] * T + win[:, 3], n) + steps
+    src, dst = torch.from_numpy(src), torch.from_numpy(dst)
+    if USE_CUDA:
+        src, dst = src.cuda(), dst.cuda()
+    res = output.new_zeros(B * T, output.size(2))
+    res[dst] = output.contiguous().view(-1, output.size(2))[src]
+    return res.view(B, T, -1)
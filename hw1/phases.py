@@ -0,0 +1,113 @@
+import time
+from collections import OrderedDict
+import torch
+from util import *
+
+# Wall time of the phases of the training loop, and a Chrome trace of a
+# range of iterations through the torch profiler. Phases are timed with
+#     with timer("forward"):
+#         ...
+# which, with both off, only returns a shared do-nothing context. On GPU
+# every phase ends with a synchronize, so the time of the kernels it
+# launched is its own (and the loop loses some overlap while timing).
+
+
+class NullPhase():
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+NULL_PHASE = NullPhase()
+
+
+class Phase():
+    def __init__(self, timer, name):
+        self.timer = timer
+        self.name = name
+        self.record = None
+
+    def __enter__(self):
+        if self.timer.prof is not None:
+            self.record = torch.profiler.record_function(self.name)
+            self.record.__enter__()
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc):
+        if USE_CUDA:
+            torch.cuda.synchronize()
+        if self.timer.enabled:
+            self.timer.add(self.name, time.time() - self.start)
+        if self.record is not None:
+            self.record.__exit__(*exc)
+        return False
+
+
+def trace_range(spec):
+    # "10:20" -> (10, 20), iterations counted from 1 over all epochs
+    first, last = [int(i) for i in spec.split(':')]
+    return first, last
+
+
+class PhaseTimer():
+    def __init__(self, enabled=False, trace="", iters=(10, 20)):
+        self.enabled = enabled
+        self.trace = trace
+        self.first, self.last = iters
+        self.prof = None
+        self.begin()
+
+    def begin(self):
+        # called at the start of every epoch
+        self.totals = OrderedDict()
+        self.n_iter = 0
+        self.start = time.time()
+
+    def __call__(self, name):
+        if not self.enabled and self.prof is None:
+            return NULL_PHASE
+        return Phase(self, name)
+
+    def add(self, name, t):
+        self.totals[name] = self.totals.get(name, 0) + t
+
+    def iteration(self, iter):
+        # called at the top of every training iteration
+        self.n_iter += 1
+        if not self.trace:
+            return
+        if iter == self.first:
+            activities = [torch.profiler.ProfilerActivity.CPU]
+            if USE_CUDA:
+                activities.append(torch.profiler.ProfilerActivity.CUDA)
+            self.prof = torch.profiler.profile(activities=activities, record_shapes=True)
+            self.prof.start()
+        elif iter == self.last + 1:
+            self.stop()
+
+    def stop(self):
+        # also at the end of training, for a range past the last iteration
+        if self.prof is None:
+            return
+        self.prof.stop()
+        self.prof.export_chrome_trace(self.trace)
+        print("  trace of iterations %d to %d in %s" % (self.first, self.last, self.trace))
+        self.prof = None
+        self.trace = ""
+
+    def epoch(self, epoch, batch_time):
+        # per-epoch table; batch_time is the loader's, the rest of the
+        # epoch that is in no phase goes to "other"
+        if not self.enabled:
+            return
+        self.add("batch", batch_time)
+        total = time.time() - self.start
+        self.add("other", total - sum(self.totals.values()))
+        print("  epoch %d PHASES (%d iterations, %.2fs)" % (epoch, self.n_iter, total))
+        for name in ["batch"] + [k for k in self.totals if k not in ("batch", "other")] + ["other"]:
+            t = self.totals[name]
+            print("    %-10s %9.2fs %9.2f ms/iter %6.1f%%" % (
+                name, t, t / max(1, self.n_iter) * 1000, t / total * 100))
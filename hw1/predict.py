@@ -6,14 +6,13 @@ import os
 import glob
 from util import *
 from timit import *
-from collections import Counter
+from decode import *
+from store import *
+from overlap import *
+from quant import *
 import random
-import model_rnn
-import model_cnn
-import model_brnn
-import model_bcnn
-import model_res
-import model_bres
+from models import *
+from loader import *
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('data', default='./data/',
@@ -31,7 +30,44 @@ parser.add_argument('-H', '--hidden_size', type=int, default=int(20))
 parser.add_argument('-b', '--batch_size', type=int, default=int(32))
 parser.add_argument('-n', '--n_layers', type=int, default=int(1))
 parser.add_argument('-d', '--dropout', type=float, default=int(0.0))
+parser.add_argument('-s', '--subsample', type=int, default=int(1),
+                    help='run the recurrent layers at 1/s of the frame rate (brnn, cnn, res)')
+parser.add_argument('--sub_mode', type=str, default='stack',
+                    help='stack or stride or pyramid')
+parser.add_argument('-N', '--norm', type=str, default='frame',
+                    help='frame or utt or global or none')
+parser.add_argument('-j', '--jobs', type=int, default=int(1),
+                    help='processes for parsing the ark files')
+parser.add_argument('-S', '--source', type=str, default='text',
+                    help='text (.ark dumps) or kaldi (binary .ark/.scp)')
+parser.add_argument('-F', '--max_frames', type=int, default=int(0),
+                    help='max (batch x maxlen) frames per batch (0: no limit)')
 parser.add_argument('-o', '--output_file', type=str, default="output.csv")
+parser.add_argument('-W', '--prefetch', type=int, default=int(0),
+                    help='# of batches prepared ahead in worker threads (0: serial)')
+parser.add_argument('-D', '--decode', type=str, default='trim',
+                    help='trim or trim2 or viterbi')
+parser.add_argument('-T', '--trans', type=str, default='',
+                    help='viterbi: transition matrix, "" uniform, "train" from train.lab, or a .npy of log probs')
+parser.add_argument('--self_loop', type=float, default=float(0.9),
+                    help='viterbi: self loop probability of the uniform transitions')
+parser.add_argument('--min_dur', type=int, default=int(3),
+                    help='viterbi: minimum # of frames of a phone')
+parser.add_argument('--chunk', type=int, default=int(0),
+                    help='run long utterances as overlapped chunks of this many frames (0: whole)')
+parser.add_argument('--left', type=int, default=int(50),
+                    help='--chunk: frames of left context')
+parser.add_argument('--right', type=int, default=int(50),
+                    help='--chunk: frames of right context')
+parser.add_argument('-Q', '--quantize', action='store_true',
+                    help='dynamic int8 quantization of the LSTM and Linear layers (CPU only); '
+                         'also saves models/<model_file>.int8.pt, which loads directly next time')
+parser.add_argument('--compare', action='store_true',
+                    help='--quantize: compare fp32 and int8 latency per batch, peak RSS, model size and frame accuracy on the validation split')
+parser.add_argument('--seed', type=int, default=int(0),
+                    help='--compare: the seed train.py was given (train.py --seed), so the validation utterances were held out')
+parser.add_argument('--post', type=str, default='',
+                    help='also write frame labels and log-posteriors (float16) to this folder, for rescore.py')
 args = parser.parse_args()
 
 
@@ -45,94 +81,87 @@ OUT_FN = args.output_file
 
 print(args.model, args.model_file, HIDDEN_SIZE, N_LAYERS, BATCH_SIZE, WINDOW_SIZE, DROPOUT)
 
-timit = TIMIT(args.data, "te", args.feat)
-
-if args.model == "rnn":
-    model = model_rnn.RNN(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "brnn":
-    model = model_brnn.BRNN(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "cnn":
-    model = model_cnn.CNN(timit.N_FEAT, WINDOW_SIZE, POOL_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "bcnn":
-    model = model_bcnn.BCNN(timit.N_FEAT, WINDOW_SIZE, POOL_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "res":
-    model = model_res.RESR(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "bres":
-    model = model_bres.BRESR(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-
-state_dict = torch.load(os.path.join("models", args.model_file), map_location=lambda storage, location: storage)
+timit = TIMIT(args.data, "te", args.feat, args.norm, args.jobs, args.source)
+
+model = build_model(args.model, timit.N_FEAT, timit.N_LABEL, HIDDEN_SIZE, BATCH_SIZE,
+                    N_LAYERS, DROPOUT, WINDOW_SIZE, POOL_SIZE, args.subsample, args.sub_mode)
+
+if (args.quantize or is_quantized_name(args.model_file)) and USE_CUDA:
+    raise SystemExit("int8 models run on the CPU only, hide the GPU with CUDA_VISIBLE_DEVICES=")
+
+if is_quantized_name(args.model_file):
+    # packed int8 weights are not plain tensors
+    state_dict = torch.load(os.path.join("models", args.model_file), map_location=lambda storage, location: storage,
+                            weights_only=False)
+    model = quantize(model.eval())
+else:
+    state_dict = torch.load(os.path.join("models", args.model_file), map_location=lambda storage, location: storage)
 model.load_state_dict(state_dict)
 model = model.eval()
 
+if args.quantize and not is_quantized_name(args.model_file):
+    fp32 = model
+    model = quantize(model)
+    torch.save(model.state_dict(), os.path.join("models", quantized_name(args.model_file)))
+    print("saved", quantized_name(args.model_file))
+    if args.compare:
+        random.seed(args.seed)
+        valid = TIMIT(args.data, "va", args.feat, args.norm, args.jobs, args.source)
+        compare(fp32, model, Prefetcher(valid, BATCH_SIZE, pin_memory=False),
+                seq_batches(len(valid.valid_set), BATCH_SIZE))
+        del valid
+
 if USE_CUDA:
     model.cuda()
 
 
 def batch_pre(inp, useful, lens):
-    # inp: (BATCH_SIZE x maxlen x timit.N_FEAT)
-    # target: (BATCH_SIZE x maxlen)
-    hidden = model.init_hidden()
-    output, hidden = model(inp, hidden, lens)
-    res = []
-
-    for i in range(useful):
-        ys = []
-        for j in range(lens[i]):
-            y = output[i][j].topk(1)[1].data[0]
-            ys.append(y)
-        res.append(ys)
-
-    return res
-
-f = open(OUT_FN, "w")
-f.write("id,phone_sequence\n")
-
-def trim(ys):
-    res = []
-    pre = -1
-    cnt = 0
-    for y in ys:
-        if pre != y:
-            if cnt > 2:
-                res.append(pre)
-            pre = y
-            cnt = 1
+    # inp: (batch x maxlen x timit.N_FEAT)
+    # returns [label ids of each utterance], one argmax and one copy to host,
+    # and for --post or viterbi [(len x N_LABEL) log-posteriors of each utterance]
+    with torch.no_grad():
+        if args.chunk > 0:
+            output = overlap_forward(model, inp, lens, args.chunk, args.left, args.right)
         else:
-            cnt += 1
-    if cnt > 2:
-        res.append(pre)
-    if len(res) == 1:
-        return res
-    if res[0] == timit.id2ascii[timit.lab2id['sil']]:
-        res = res[1:]
-    if res[-1] == timit.id2ascii[timit.lab2id['sil']]:
-        res = res[:-1]
-    return res
-
-FRAME = 6
-def trim2(ys):
-    res = []
-    pre = -1
-    cnt = 0
-    for i in range(len(ys) - FRAME + 1):
-        frame = ys[i: i+FRAME]
-        cnter = Counter(frame)
-        y = cnter.most_common()[0][0]
-        if y != pre and y != timit.id2ascii[timit.lab2id['sil']]:
-            res.append(y)
-        pre = y
-    return res
-
-
-for i in range(0, len(timit.te_set), BATCH_SIZE):
-    inputs, ids, useful = timit.get_batch(i, BATCH_SIZE, "te")
-    inputs, ids, lens = make_batch_te(inputs, ids, timit.N_FEAT)
-    # print(ids)
-    res = batch_pre(inputs, useful, lens)
+            hidden = model.init_hidden(len(lens))
+            output, hidden = model(inp, hidden, lens)
+    ys = output.max(2)[1].data.cpu().numpy()
+    posts = None
+    if args.post or args.decode == "viterbi":
+        lp = F.log_softmax(output, 2).data.cpu().numpy()
+        posts = [lp[i, :lens[i]] for i in range(useful)]
+    return [ys[i, :lens[i]] for i in range(useful)], posts
+
+
+loader = Prefetcher(timit, BATCH_SIZE, args.prefetch, max(1, args.prefetch // 2))
+
+codes = char_codes(timit.id2ascii, timit.N_LABEL)
+SIL = codes[timit.lab2id['sil']]
+if args.decode == "viterbi":
+    log_trans = load_transitions(args.trans, args.data, timit.lab2id, timit.N_LABEL, args.self_loop)
+
+# batches in order of length, written back in the order of the test set
+batches = BucketSampler([len(xs) for (xs, id) in timit.te_set],
+                        BATCH_SIZE, 1, args.max_frames).sorted_batches()
+answers = {}
+posts = {}
+for inputs, ids, useful, lens in loader(batches, "te"):
+    res, lps = batch_pre(inputs, useful, lens)
+    if args.decode == "viterbi":
+        ans = viterbi_decode(lps, codes, SIL, log_trans, args.min_dur)
+    else:
+        ans = [post_process(ys, codes, SIL, args.decode) for ys in res]
     for j in range(useful):
-        ans = ''.join(timit.id2ascii[y] for y in res[j])
-        ans = ''.join(trim(ans))
-        f.write("%s,%s\n" % (ids[j], ans))
+        answers[ids[j]] = ans[j]
+        if args.post:
+            # the float32 argmax goes along, so rescore.py gets the same labels
+            posts[ids[j]] = (res[j], lps[j].astype(np.float16))
 
+f = open(OUT_FN, "w")
+f.write("id,phone_sequence\n")
+for (xs, id) in timit.te_set:
+    f.write("%s,%s\n" % (id, answers[id]))
 f.close()
 
+if args.post:
+    build_store(((posts[id][0], posts[id][1], id) for (xs, id) in timit.te_set), args.post, np.float16)
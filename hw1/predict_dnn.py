@@ -40,7 +40,7 @@ print(args.model, args.model_file, FRAME_SIZE, HIDDEN_SIZE, N_LAYERS, BATCH_SIZE
 timit = TIMIT(args.data, "te", args.feat)
 
 if args.model == "dnn":
-    model = model_dnn.DNN(timit.N_FEAT, FRAME_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, 0)
+    model = model_dnn.DNN(timit.N_FEAT, FRAME_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE)
 elif args.model == "dcnn":
     model = model_dcnn.CNN(timit.N_FEAT, FRAME_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, 0)
 
@@ -57,7 +57,7 @@ def batch_pre(inp, useful):
     # inp: (BATCH_SIZE x timit.N_FEAT)
     output = model(inp)
     output = output.max(1)[1].data[:useful]
-    return list(output)
+    return output.cpu().tolist()
 
 
 phseq = {}
@@ -66,7 +66,9 @@ phseq = {}
 for i in range(0, len(timit.te_idx_set), BATCH_SIZE):
     xss, ids, useful = timit.get_flat_batch(i, BATCH_SIZE, FRAME_SIZE, "te")
     print(ids)
-    X = Variable(torch.Tensor(xss))
+    X = Variable(torch.from_numpy(xss))
+    if USE_CUDA:
+        X = X.cuda()
     res = batch_pre(X, useful)
     for (y, (i, j)) in zip(res, ids):
         if i not in phseq:
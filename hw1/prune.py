@@ -0,0 +1,182 @@
+import argparse
+import os
+import re
+import sys
+import subprocess
+from util import *
+from timit import *
+from models import *
+from loader import *
+from quant import run_split
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('data', default='./data/',
+                    help='data folder')
+parser.add_argument('feat', default='mfcc',
+                    help='mfcc or fbank or all')
+parser.add_argument('model_file', default='brnn.pt',
+                    help='brnn model file')
+parser.add_argument('-H', '--hidden_size', type=int, default=int(20))
+parser.add_argument('-n', '--n_layers', type=int, default=int(1))
+parser.add_argument('-d', '--dropout', type=float, default=int(0.0))
+parser.add_argument('-b', '--batch_size', type=int, default=int(32))
+parser.add_argument('-N', '--norm', type=str, default='frame',
+                    help='frame or utt or global or none')
+parser.add_argument('--hiddens', type=str, default='512,256',
+                    help='comma separated hidden sizes to prune to')
+parser.add_argument('--layers', type=str, default='4,2',
+                    help='comma separated layer counts to prune to')
+parser.add_argument('-e', '--n_epoch', type=int, default=int(2),
+                    help='fine-tuning epochs (0: no fine-tuning)')
+parser.add_argument('-l', '--lr', type=float, default=float(0.0001))
+parser.add_argument('--seed', type=int, default=int(0),
+                    help='same seed for ranking and fine-tuning, so both use one validation split')
+args = parser.parse_args()
+
+# Structured pruning of a BRNN checkpoint. Layers are dropped greedily,
+# each time the one whose removal hurts validation accuracy least (layer
+# k + 1 then reads layer k - 1, both are 2H wide). Hidden units are ranked
+# per layer and direction by the L2 norm of every weight into and out of
+# them, and the top H' are kept. The result is a plain BRNN state dict
+# with -H H' -n n', fine-tuned with train.py -M; predict.py loads it with
+# the same -H / -n.
+
+
+def lstm_key(w, k, d):
+    return "lstm.%s_l%d%s" % (w, k, "_reverse" if d else "")
+
+
+def gate_rows(keep, H):
+    # rows of the 4 stacked gates (i, f, g, o) of the kept units
+    return np.concatenate([g * H + keep for g in range(4)])
+
+
+def unit_scores(sd, H, n):
+    scores = {}
+    for k in range(n):
+        for d in range(2):
+            s = np.zeros(H)
+            for w in ("weight_ih", "weight_hh"):
+                rows = sd[lstm_key(w, k, d)].numpy().reshape(4, H, -1)
+                s += (rows ** 2).sum((0, 2))
+            s += (sd[lstm_key("weight_hh", k, d)].numpy() ** 2).sum(0)
+            if k + 1 < n:
+                for d2 in range(2):
+                    s += (sd[lstm_key("weight_ih", k + 1, d2)].numpy()[:, d * H:(d + 1) * H] ** 2).sum(0)
+            else:
+                s += (sd["decoder%s.weight" % ("rl" if d else "lr")].numpy() ** 2).sum(0)
+            scores[k, d] = np.sqrt(s)
+    return scores
+
+
+def prune_units(sd, H, n, H2):
+    scores = unit_scores(sd, H, n)
+    keep = {kd: np.sort(np.argsort(-s, kind='stable')[:H2]) for kd, s in scores.items()}
+    res = {}
+    for k in range(n):
+        for d in range(2):
+            rows = torch.from_numpy(gate_rows(keep[k, d], H))
+            ih = sd[lstm_key("weight_ih", k, d)][rows]
+            if k > 0:
+                cols = torch.from_numpy(np.concatenate([keep[k - 1, 0], H + keep[k - 1, 1]]))
+                ih = ih[:, cols]
+            own = torch.from_numpy(keep[k, d])
+            res[lstm_key("weight_ih", k, d)] = ih.clone()
+            res[lstm_key("weight_hh", k, d)] = sd[lstm_key("weight_hh", k, d)][rows][:, own].clone()
+            res[lstm_key("bias_ih", k, d)] = sd[lstm_key("bias_ih", k, d)][rows].clone()
+            res[lstm_key("bias_hh", k, d)] = sd[lstm_key("bias_hh", k, d)][rows].clone()
+    for d, name in enumerate(("decoderlr", "decoderrl")):
+        res[name + ".weight"] = sd[name + ".weight"][:, torch.from_numpy(keep[n - 1, d])].clone()
+        res[name + ".bias"] = sd[name + ".bias"].clone()
+    return res
+
+
+def drop_layer(sd, n, k):
+    res = {}
+    for key, v in sd.items():
+        m = re.match(r"lstm\.(\w+)_l(\d+)(_reverse)?$", key)
+        if m is None:
+            res[key] = v
+            continue
+        j = int(m.group(2))
+        if j == k:
+            continue
+        res[lstm_key(m.group(1), j - (j > k), m.group(3) is not None)] = v
+    return res
+
+
+def brnn_flops(n_feat, H, n, n_label):
+    # multiply-adds x 2 per frame: 4 gates per direction, two decoders
+    f = 0
+    for k in range(n):
+        f += 2 * 2 * 4 * H * ((n_feat if k == 0 else 2 * H) + H)
+    return f + 2 * 2 * H * n_label
+
+
+def load(sd, H, n):
+    model = build_model("brnn", timit.N_FEAT, timit.N_LABEL, H, args.batch_size, n, args.dropout)
+    model.load_state_dict(sd)
+    model = model.eval()
+    if USE_CUDA:
+        model.cuda()
+    return model
+
+
+def accuracy(sd, H, n):
+    return run_split(load(sd, H, n), loader, valid_batches)[0]
+
+
+def fine_tune(name, H, n):
+    # train.py warm start from models/<name>; its last VALID line is the
+    # result, saved as models/<name without .pt>.ft.e<n_epoch>.pt
+    tag = name[:-len(".pt")] + ".ft"
+    cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "train.py"),
+           args.data, args.feat, "brnn", "-M", name, "-H", str(H), "-n", str(n),
+           "-d", str(args.dropout), "-b", str(args.batch_size), "-e", str(args.n_epoch),
+           "-l", str(args.lr), "-N", args.norm, "--seed", str(args.seed), "--name", tag]
+    out = subprocess.run(cmd, stdout=subprocess.PIPE, universal_newlines=True, check=True).stdout
+    acc = re.findall(r"VALID LOSS \S+ ACC ([\d.]+)%", out)[-1]
+    return float(acc) / 100, "%s.e%d.pt" % (tag, args.n_epoch)
+
+
+random.seed(args.seed)
+timit = TIMIT(args.data, "tr", args.feat, args.norm)
+loader = Prefetcher(timit, args.batch_size)
+valid_batches = seq_batches(len(timit.valid_set), args.batch_size)
+
+H, n = args.hidden_size, args.n_layers
+sd = torch.load(os.path.join("models", args.model_file), map_location=lambda storage, location: storage)
+rows = [("original", H, n, accuracy(sd, H, n), None)]
+
+# greedy layer dropping, every layer count on the way is a candidate
+by_layers = {n: sd}
+cur = sd
+targets = sorted([int(l) for l in args.layers.split(',')])
+for n2 in range(n - 1, targets[0] - 1, -1):
+    tries = [(accuracy(drop_layer(cur, n2 + 1, k), H, n2), k) for k in range(1, n2 + 1)]
+    acc, k = max(tries)
+    print("drop layer %d of %d: acc %.4f" % (k, n2 + 1, acc))
+    cur = drop_layer(cur, n2 + 1, k)
+    by_layers[n2] = cur
+
+base = args.model_file[:-len(".pt")]
+for n2 in [n] + targets:
+    for H2 in [H] + [int(h) for h in args.hiddens.split(',')]:
+        if (n2, H2) == (n, H) or n2 > n or H2 > H:
+            continue
+        pruned = prune_units(by_layers[n2], H, n2, H2) if H2 < H else by_layers[n2]
+        name = "%s.prune.h%d.l%d.pt" % (base, H2, n2)
+        torch.save(pruned, os.path.join("models", name))
+        acc = accuracy(pruned, H2, n2)
+        if args.n_epoch > 0:
+            ft, name = fine_tune(name, H2, n2)
+        else:
+            ft = None
+        rows.append((name, H2, n2, acc, ft))
+        print("%s: acc %.4f%s" % (name, acc, "" if ft is None else " fine-tuned %.4f" % ft))
+
+print("%-56s %5s %3s %10s %10s %10s" % ("model", "H", "n", "MFLOPs/fr", "acc", "fine-tuned"))
+for name, H2, n2, acc, ft in sorted(rows, key=lambda r: -brnn_flops(timit.N_FEAT, r[1], r[2], timit.N_LABEL)):
+    print("%-56s %5d %3d %10.2f %9.2f%% %10s" % (
+        name, H2, n2, brnn_flops(timit.N_FEAT, H2, n2, timit.N_LABEL) / 1e6, acc * 100,
+        "" if ft is None else "%.2f%%" % (ft * 100)))
@@ -0,0 +1,81 @@
+import io
+import multiprocessing
+import time
+import torch
+import torch.nn as nn
+import numpy as np
+from util import *
+
+# Dynamic int8 quantization for CPU inference: LSTM and Linear weights are
+# stored as int8 and activations are quantized on the fly. nn.RNN (res,
+# bres) and the convs stay in float32.
+
+
+def quantize(model):
+    return torch.quantization.quantize_dynamic(model, {nn.LSTM, nn.Linear}, dtype=torch.qint8)
+
+
+def quantized_name(model_file):
+    # brnn.all.e20....pt -> brnn.all.e20....int8.pt
+    return model_file[:-len(".pt")] + ".int8.pt"
+
+
+def is_quantized_name(model_file):
+    return model_file.endswith(".int8.pt")
+
+
+def model_bytes(model):
+    # model size: bytes of the saved state dict, not the memory it takes
+    # while running
+    buf = io.BytesIO()
+    torch.save(model.state_dict(), buf)
+    return buf.tell()
+
+
+def run_split(model, loader, batches):
+    # frame accuracy and the seconds spent in the model on every batch of a
+    # labelled split
+    correct = 0
+    total = 0
+    times = []
+    with torch.no_grad():
+        for input, target, ids, useful, lens in loader(batches, "va"):
+            start = time.time()
+            output, hidden = model(input, model.init_hidden(len(lens)), lens)
+            times.append(time.time() - start)
+            ys = output.max(2)[1].data.cpu().numpy()
+            ts = target.data.cpu().numpy()
+            for i in range(useful):
+                correct += int((ys[i, :lens[i]] == ts[i, :lens[i]]).sum())
+                total += lens[i]
+    return correct / total, np.array(times), total
+
+
+def split_run(model, loader, batches, queue):
+    # run_split and the growth of the peak RSS over it
+    base = rss_mb()
+    acc, times, n = run_split(model, loader, batches)
+    queue.put((acc, times, n, peak_rss_mb() - base))
+
+
+def measured_split(model, loader, batches):
+    # the peak RSS only goes up, so every model runs in a fresh fork
+    ctx = multiprocessing.get_context("fork")
+    queue = ctx.Queue()
+    p = ctx.Process(target=split_run, args=(model, loader, batches, queue))
+    p.start()
+    res = queue.get()
+    p.join()
+    return res
+
+
+def compare(fp32, int8, loader, batches):
+    # latency: wall time of one batch in the model; memory: peak RSS growth
+    # while running the split, loading and collating included
+    print("%-6s %15s %13s %11s %12s %12s %10s" % (
+        "", "model size MB", "ms/batch p50", "p95", "peak RSS MB", "frames/s", "acc"))
+    for name, model in [("fp32", fp32), ("int8", int8)]:
+        acc, times, n, mb = measured_split(model, loader, batches)
+        print("%-6s %15.2f %13.2f %11.2f %12.1f %12.1f %9.4f%%" % (
+            name, model_bytes(model) / 2 ** 20, np.median(times) * 1000, np.percentile(times, 95) * 1000,
+            mb, n / times.sum(), acc * 100))
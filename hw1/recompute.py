@@ -0,0 +1,65 @@
+from contextlib import contextmanager
+import torch.nn as nn
+from torch.utils.checkpoint import checkpoint
+
+# Activation checkpointing for the RES blocks of res / bres. A checkpointed
+# block keeps only its input for backward and runs its forward again to get
+# the rest. The second run normalizes with the same batch statistics, but
+# must not move the BatchNorm running mean / var a second time, so they are
+# put back as they were after the first run.
+
+RES_BLOCKS = (1, 2, 3, 4)
+
+
+def res_blocks(spec):
+    # "" or "none" -> (), "all" -> (1, 2, 3, 4), "1,2" -> (1, 2),
+    # "1-3" -> (1, 2, 3)
+    if spec in ("", "none"):
+        return ()
+    if spec == "all":
+        return RES_BLOCKS
+    blocks = set()
+    for part in spec.split(','):
+        lo, _, hi = part.partition('-')
+        lo, hi = int(lo), int(hi or lo)
+        if lo > hi:
+            raise ValueError("empty RES block range %s" % part)
+        blocks.update(range(lo, hi + 1))
+    blocks = tuple(sorted(blocks))
+    for b in blocks:
+        if b not in RES_BLOCKS:
+            raise ValueError("no RES block %d (1 to 4)" % b)
+    return blocks
+
+
+@contextmanager
+def frozen_bn(module):
+    saved = [(bn, bn.running_mean.clone(), bn.running_var.clone(), bn.num_batches_tracked.clone())
+             for bn in module.modules()
+             if isinstance(bn, nn.BatchNorm2d) and bn.track_running_stats]
+    try:
+        yield
+    finally:
+        # also when checkpoint stops the recomputation early
+        for bn, mean, var, n in saved:
+            bn.running_mean.copy_(mean)
+            bn.running_var.copy_(var)
+            bn.num_batches_tracked.copy_(n)
+
+
+def recompute(module, fn, input):
+    first = [True]
+
+    def run(input):
+        if first[0]:
+            first[0] = False
+            return fn(input)
+        with frozen_bn(module):
+            return fn(input)
+
+    return checkpoint(run, input, use_reentrant=False)
+
+
+def set_checkpoint(model, blocks):
+    for b in blocks:
+        getattr(model, "res%d" % b).checkpoint = True
@@ -0,0 +1,64 @@
+import argparse
+import os
+from util import *
+from store import *
+from decode import *
+
+parser = argparse.ArgumentParser(description='')
+parser.add_argument('data', default='./data/',
+                    help='data folder (for the phone maps)')
+parser.add_argument('post', default='post',
+                    help='folder written by predict.py --post')
+parser.add_argument('-m', '--min_run', type=int, default=int(3),
+                    help='trim: shortest run of frames kept')
+parser.add_argument('-f', '--frame', type=int, default=int(6),
+                    help='trim2: sliding window size')
+parser.add_argument('-D', '--decode', type=str, default='trim',
+                    help='trim or trim2 or viterbi')
+parser.add_argument('-T', '--trans', type=str, default='',
+                    help='viterbi: transition matrix, "" uniform, "train" from train.lab, or a .npy of log probs')
+parser.add_argument('--self_loop', type=float, default=float(0.9),
+                    help='viterbi: self loop probability of the uniform transitions')
+parser.add_argument('--min_dur', type=int, default=int(3),
+                    help='viterbi: minimum # of frames of a phone')
+parser.add_argument('-b', '--batch_size', type=int, default=int(64),
+                    help='viterbi: utterances decoded together')
+parser.add_argument('-o', '--output_file', type=str, default="output.csv")
+args = parser.parse_args()
+
+
+lab2id, id2ascii = make_lab2id(
+    os.path.join(args.data, "48phone_char.map"),
+    os.path.join(args.data, "phones", "48_39.map"))
+
+start = time.time()
+store = FeatureStore(args.post, np.float16)
+codes = char_codes(id2ascii, store.n_feat)
+SIL = codes[lab2id['sil']]
+
+answers = {}
+if args.decode == "viterbi":
+    log_trans = load_transitions(args.trans, args.data, lab2id, store.n_feat, args.self_loop)
+    # utterances of similar length share a padded batch
+    order = np.argsort(store.index[:, 1], kind='stable')
+    for i in range(0, len(order), args.batch_size):
+        batch = order[i:i + args.batch_size]
+        lps = [store.frames[o:o + l] for o, l in store.index[batch]]
+        for k, ans in zip(batch, viterbi_decode(lps, codes, SIL, log_trans, args.min_dur)):
+            answers[store.ids[k]] = ans
+else:
+    # the frame labels predict.py took from its float32 outputs; a store
+    # without them only has the float16 log-posteriors, whose argmax can
+    # differ from predict.py's on near ties
+    labels = store.labels
+    if labels is None:
+        labels = np.asarray(store.frames).argmax(1)
+    for (o, l), id in zip(store.index, store.ids):
+        answers[id] = post_process(labels[o:o + l], codes, SIL, args.decode, args.min_run, args.frame)
+
+f = open(args.output_file, "w")
+f.write("id,phone_sequence\n")
+for id in store.ids:
+    f.write("%s,%s\n" % (id, answers[id]))
+f.close()
+print("%d utterances, %d frames rescored in %s" % (len(store), store.n_frames, time_since(start)))
@@ -0,0 +1,129 @@
+import os
+import json
+import numpy as np
+
+# On-disk layout of a compiled split (one directory per feat/norm/split):
+#   frames.f32  contiguous float32 frames, (n_frames x n_feat); named after
+#               the dtype, e.g. frames.f16 for a float16 store
+#   labels.i64  int64 frame labels, (n_frames), only for labelled splits
+#   index.npy   int64 (n_utt x 2) of (offset, length) into frames
+#   ids.txt     one utterance id per line, same order as index.npy
+#   sources.json  fingerprint of the files the store was built from
+
+
+def store_dir(data_folder, feat, split, norm="frame"):
+    return os.path.join(data_folder, "store", "%s.%s.%s" % (feat, norm, split))
+
+
+def frames_file(path, dtype=np.float32):
+    dtype = np.dtype(dtype)
+    return os.path.join(path, "frames.%s%d" % (dtype.kind, dtype.itemsize * 8))
+
+
+def fingerprint(fs):
+    # path, size and mtime of every input file: a cache made from other
+    # files, or from the same files rewritten since, no longer matches
+    res = []
+    for f in fs:
+        st = os.stat(f)
+        res.append([os.path.abspath(f), st.st_size, st.st_mtime_ns])
+    return res
+
+
+def save_fingerprint(fn, fs):
+    with open(fn, "w") as f:
+        json.dump(fingerprint(fs), f)
+
+
+def same_fingerprint(fn, fs):
+    if not os.path.exists(fn):
+        return False
+    with open(fn) as f:
+        return json.load(f) == fingerprint(fs)
+
+
+def has_store(path, sources=None):
+    # with sources, only a store built from those very files counts
+    if not os.path.exists(os.path.join(path, "index.npy")):
+        return False
+    if sources is None or same_fingerprint(os.path.join(path, "sources.json"), sources):
+        return True
+    print("%s was built from other or older files, not using it (run build_store.py again)" % path)
+    return False
+
+
+def build_store(pairs, path, dtype=np.float32, sources=None):
+    # pairs: iterable of (ys, xs, id) or (xs, id); sources: the input files,
+    # fingerprinted for has_store
+    os.makedirs(path, exist_ok=True)
+    if os.path.exists(os.path.join(path, "index.npy")):
+        # an old index must not pair up with the new frames
+        os.remove(os.path.join(path, "index.npy"))
+    index = []
+    ids = []
+    offset = 0
+    frames_f = frames_file(path, dtype)
+    ff = open(frames_f + ".tmp", "wb")
+    lf = None
+    for p in pairs:
+        if len(p) == 3:
+            ys, xs, id = p
+            if lf is None:
+                lf = open(os.path.join(path, "labels.i64.tmp"), "wb")
+            lf.write(np.ascontiguousarray(ys, dtype=np.int64).tobytes())
+        else:
+            xs, id = p
+        ff.write(np.ascontiguousarray(xs, dtype=dtype).tobytes())
+        index.append((offset, len(xs)))
+        ids.append(id)
+        offset += len(xs)
+    ff.close()
+    os.replace(frames_f + ".tmp", frames_f)
+    if lf is not None:
+        lf.close()
+        os.replace(os.path.join(path, "labels.i64.tmp"), os.path.join(path, "labels.i64"))
+
+    with open(os.path.join(path, "ids.txt"), "w") as f:
+        f.write("\n".join(ids) + "\n")
+    if os.path.exists(os.path.join(path, "sources.json")):
+        os.remove(os.path.join(path, "sources.json"))
+    if sources is not None:
+        save_fingerprint(os.path.join(path, "sources.json"), sources)
+    # index.npy goes last so a half-written store is never picked up
+    np.save(os.path.join(path, "index.npy"), np.array(index, dtype=np.int64).reshape(-1, 2))
+    print("store %s: %d utterances, %d frames" % (path, len(ids), offset))
+
+
+class FeatureStore():
+    def __init__(self, path, dtype=np.float32):
+        self.path = path
+        self.index = np.load(os.path.join(path, "index.npy"))
+        with open(os.path.join(path, "ids.txt")) as f:
+            self.ids = f.read().split()
+        self.n_frames = int(self.index[:, 1].sum())
+
+        frames_f = frames_file(path, dtype)
+        n_bytes = os.path.getsize(frames_f)
+        self.n_feat = n_bytes // (np.dtype(dtype).itemsize * max(self.n_frames, 1))
+        # read-only maps: pages are shared between processes via the page cache
+        self.frames = np.memmap(frames_f, dtype=dtype, mode="r",
+                                shape=(self.n_frames, self.n_feat))
+
+        self.labels = None
+        labels_f = os.path.join(path, "labels.i64")
+        if os.path.exists(labels_f):
+            self.labels = np.memmap(labels_f, dtype=np.int64, mode="r",
+                                    shape=(self.n_frames,))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __getitem__(self, i):
+        # zero-copy views into the maps
+        o, l = self.index[i]
+        if self.labels is None:
+            return (self.frames[o:o + l], self.ids[i])
+        return (self.labels[o:o + l], self.frames[o:o + l], self.ids[i])
+
+    def pairs(self):
+        return [self[i] for i in range(len(self))]
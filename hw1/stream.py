@@ -0,0 +1,145 @@
+import torch
+import torch.nn.functional as F
+from util import *
+from model_rnn import RNN
+from model_cnn import CNN
+from model_res import RESR
+
+# Streaming inference for the unidirectional models. Frames come in chunks
+# of any size; the recurrent state is carried from one chunk to the next,
+# and every conv over time keeps the last (kernel - 1) frames of its input,
+# so the zero padding only ever shows up at the two ends of the utterance
+# and the output is the same as running the whole utterance at once. A
+# conv with padding p can only finish frame t once frame t + p is in, so
+# each conv layer holds its output back by p frames (the lookahead).
+
+
+class ConvStream():
+    # a Conv2d over (batch x ch x time x feat) run on chunks of time
+    def __init__(self, conv):
+        self.conv = conv
+        self.k = conv.kernel_size[0]
+        self.pad = conv.padding[0]
+        self.lookahead = self.k - 1 - self.pad
+        self.reset()
+
+    def reset(self):
+        self.buf = None
+
+    def __call__(self, x, last=False):
+        if self.buf is None:
+            # left zero padding of the utterance
+            self.buf = x.new_zeros(x.size(0), x.size(1), self.pad, x.size(3))
+        buf = torch.cat((self.buf, x), 2)
+        if last:
+            buf = torch.cat((buf, x.new_zeros(x.size(0), x.size(1), self.lookahead, x.size(3))), 2)
+        self.buf = buf[:, :, max(0, buf.size(2) - (self.k - 1)):]
+        if buf.size(2) < self.k:
+            return x.new_zeros(x.size(0), self.conv.out_channels, 0, self.out_feat(x))
+        return F.conv2d(buf, self.conv.weight, self.conv.bias, self.conv.stride,
+                        (0, self.conv.padding[1]), self.conv.dilation, self.conv.groups)
+
+    def out_feat(self, x):
+        return (x.size(3) + 2 * self.conv.padding[1] - self.conv.kernel_size[1]) // self.conv.stride[1] + 1
+
+
+class ResStream():
+    # one RES block: the 1x1 conv is per frame, the k x k convs each hold
+    # back their lookahead, and the residual waits for them
+    def __init__(self, res):
+        self.res = res
+        mods = list(res.convs)
+        self.stages = []
+        for k in range(0, len(mods), 3):
+            self.stages.append((ConvStream(mods[k]), mods[k + 1], mods[k + 2]))
+        self.lookahead = sum(c.lookahead for c, bn, relu in self.stages)
+        self.reset()
+
+    def reset(self):
+        for c, bn, relu in self.stages:
+            c.reset()
+        self.resi = None
+
+    def __call__(self, x, last=False):
+        if x.size(2) == 0:
+            if not last or self.resi is None:
+                return x.new_zeros(x.size(0), self.res.out_ch, 0, x.size(3))
+            # flush: nothing new for the 1x1 convs, only the held back frames
+            x = x.new_zeros(x.size(0), self.res.out_ch, 0, x.size(3))
+        else:
+            resi = x
+            if self.res.proj is not None:
+                resi = self.res.proj(resi)
+            self.resi = resi if self.resi is None else torch.cat((self.resi, resi), 2)
+            x = self.res.relu(self.res.bn1(self.res.conv1(x)))
+        for c, bn, relu in self.stages:
+            x = c(x, last)
+            if x.size(2) > 0:
+                x = relu(bn(x))
+        n = x.size(2)
+        out = self.resi[:, :, :n] + x
+        self.resi = self.resi[:, :, n:]
+        return out
+
+
+class Streamer():
+    # streamer = Streamer(model); streamer(chunk) for every (n x N_FEAT)
+    # chunk of one utterance, streamer(chunk, last=True) for the final one
+    # (which may be empty, to flush the lookahead of a live feed).
+    # Each call returns the (m x N_LABEL) outputs of the frames it could
+    # finish, m <= n; over the whole utterance every frame comes out once.
+    def __init__(self, model):
+        self.model = model.eval()
+        if getattr(model, "subsample", 1) > 1:
+            raise ValueError("streaming does not support subsampled models")
+        if isinstance(model, CNN):
+            self.convs = [ConvStream(model.conv)]
+        elif isinstance(model, RESR):
+            self.convs = [ResStream(r) for r in (model.res1, model.res2, model.res3, model.res4)]
+        elif isinstance(model, RNN):
+            self.convs = []
+        else:
+            raise ValueError("%s is not a streaming model" % type(model).__name__)
+        self.lookahead = sum(c.lookahead for c in self.convs)
+        self.reset()
+
+    def reset(self):
+        self.hc = self.model.init_hidden(1)
+        for c in self.convs:
+            c.reset()
+
+    def __call__(self, chunk, last=False):
+        m = self.model
+        with torch.no_grad():
+            x = torch.as_tensor(chunk, dtype=torch.float32)
+            if USE_CUDA:
+                x = x.cuda()
+            n = x.numel() // m.input_size
+            x = x.view(1, n, m.input_size)
+            if isinstance(m, CNN):
+                x = self.convs[0](x.unsqueeze(1), last)
+                if x.size(2) == 0:
+                    out = x.new_zeros(1, 0, m.output_size)
+                else:
+                    x = x.view(1, -1, m.input_size - m.window_size[1] + 1)
+                    x = m.relu(m.pool(x))
+                    x, self.hc = m.lstm(x, self.hc)
+                    out = m.decoder(x)
+            elif isinstance(m, RESR):
+                # the recurrent step does not take an empty chunk
+                if n > 0:
+                    x, self.hc = m.rnn(x, self.hc)
+                else:
+                    x = x.new_zeros(1, 0, m.hidden_size)
+                x = x.unsqueeze(1)
+                for c in self.convs:
+                    x = c(x, last)
+                out = m.W(torch.cat((x[:, 0], x[:, 1]), dim=2))
+            elif n > 0:
+                x, self.hc = m.lstm(x, self.hc)
+                out = m.decoder(x)
+            else:
+                out = x.new_zeros(1, 0, m.output_size)
+        if last:
+            self.reset()
+        return out[0]
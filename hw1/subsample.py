@@ -0,0 +1,119 @@
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
+
+# Frame-rate reduction for the recurrent models. The recurrent layers run
+# at 1/k of the frame rate and their outputs are repeated k times, so the
+# models still return one output per frame.
+#   stack:   k neighbouring frames concatenated into one (k x feat) step
+#   stride:  every k-th frame
+#   pyramid: full rate into the first layer, then neighbouring outputs
+#            stacked by 2 (or k when k is not a power of 2) between layers
+
+SUB_MODES = ("stack", "stride", "pyramid")
+
+
+def sub_lens(lens, k):
+    return [(l + k - 1) // k for l in lens]
+
+
+def stack_frames(x, k):
+    # (batch x T x feat) -> (batch x ceil(T / k) x k * feat), zero padded
+    B, T, n_feat = x.size()
+    pad = -T % k
+    if pad:
+        x = torch.cat((x, x.new_zeros(B, pad, n_feat)), 1)
+    return x.contiguous().view(B, (T + pad) // k, k * n_feat)
+
+
+def front_end(x, lens, k, mode):
+    if k == 1 or mode == "pyramid":
+        return x, lens
+    if mode == "stack":
+        return stack_frames(x, k), sub_lens(lens, k)
+    if mode == "stride":
+        return x[:, ::k], sub_lens(lens, k)
+    raise ValueError("unknown subsampling %s" % mode)
+
+
+def front_size(input_size, k, mode):
+    return input_size * k if mode == "stack" else input_size
+
+
+def upsample(x, k, T):
+    # (batch x T' x C) -> (batch x T x C), every step repeated k times
+    if k == 1:
+        return x
+    B, T_, C = x.size()
+    return x.unsqueeze(2).expand(B, T_, k, C).contiguous().view(B, T_ * k, C)[:, :T].contiguous()
+
+
+def pyramid_steps(k):
+    steps = []
+    while k > 1 and k % 2 == 0:
+        steps.append(2)
+        k //= 2
+    if k > 1:
+        steps.append(k)
+    return steps
+
+
+class PyramidRNN(nn.Module):
+    # an nn.LSTM / nn.RNN stack with frames stacked between layers; takes
+    # and returns the hidden state in the shape of the plain multi-layer one
+    def __init__(self, rnn_type, input_size, hidden_size, n_layers, k,
+                 dropout=0.0, bidirectional=False):
+        super(PyramidRNN, self).__init__()
+        self.steps = pyramid_steps(k)
+        if len(self.steps) > n_layers - 1:
+            raise ValueError("a x%d pyramid needs at least %d layers" % (k, len(self.steps) + 1))
+        self.n_dir = 2 if bidirectional else 1
+        self.dropout = dropout
+        layers = []
+        size = input_size
+        for i in range(n_layers):
+            if 0 < i <= len(self.steps):
+                size *= self.steps[i - 1]
+            layers.append(rnn_type(size, hidden_size, 1, batch_first=True,
+                                   bidirectional=bidirectional))
+            size = hidden_size * self.n_dir
+        self.layers = nn.ModuleList(layers)
+
+    def forward(self, input, hc, lens):
+        lstm = isinstance(hc, tuple)
+        hs = []
+        for i, layer in enumerate(self.layers):
+            if 0 < i <= len(self.steps):
+                input = stack_frames(input, self.steps[i - 1])
+                lens = sub_lens(lens, self.steps[i - 1])
+            if i > 0:
+                input = F.dropout(input, self.dropout, self.training)
+            part = slice(i * self.n_dir, (i + 1) * self.n_dir)
+            h = (hc[0][part], hc[1][part]) if lstm else hc[part]
+            output_p, h = layer(pack_padded_sequence(input, lens, batch_first=True), h)
+            input, _ = pad_packed_sequence(output_p, batch_first=True)
+            hs.append(h)
+        if lstm:
+            hc = (torch.cat([h[0] for h in hs]), torch.cat([h[1] for h in hs]))
+        else:
+            hc = torch.cat(hs)
+        return input, hc
+
+
+def make_rnn(rnn_type, input_size, hidden_size, n_layers, dropout=0.0,
+             bidirectional=False, k=1, mode="stack"):
+    if k > 1 and mode == "pyramid":
+        return PyramidRNN(rnn_type, input_size, hidden_size, n_layers, k, dropout, bidirectional)
+    return rnn_type(front_size(input_size, k, mode), hidden_size, n_layers,
+                    batch_first=True, dropout=dropout, bidirectional=bidirectional)
+
+
+def run_rnn(rnn, input, hc, lens):
+    # padded in, padded out
+    if isinstance(rnn, PyramidRNN):
+        return rnn(input, hc, lens)
+    input_p = pack_padded_sequence(input, lens, batch_first=True)
+    output_p, hc = rnn(input_p, hc)
+    output, _ = pad_packed_sequence(output_p, batch_first=True)
+    return output, hc
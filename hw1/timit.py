@@ -1,19 +1,18 @@
 import torch
 import random
 from util import *
+from store import *
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 import os
 import copy
 import numpy as np
 
 class TIMIT():
-    def __init__(self, data_folder, type="tr", feat="mfcc"):
+    def __init__(self, data_folder, type="tr", feat="mfcc", norm="frame", n_workers=1,
+                 source="text"):
         self.feat = feat
-        self.N_FEAT = 39
-        if feat == "fbank":
-            self.N_FEAT = 69
-        elif feat == "all":
-            self.N_FEAT = 39 + 69
+        self.norm = norm
+        self.N_FEAT = TIMIT.n_feat(feat)
         self.N_LABEL = 39 + 1
         self.data = data_folder
 
@@ -23,17 +22,20 @@ class TIMIT():
         print(self.lab2id)
         print(self.id2ascii)
 
+        stats = None
+        if norm == "global":
+            stats = global_cmvn(self.data, feat, n_workers, source)
+
         if type == "tr":
-            train_f = []
-            if feat == "all":
-                train_f.append(os.path.join(self.data, "mfcc", "train.ark"))
-                train_f.append(os.path.join(self.data, "fbank", "train.ark"))
+            path = store_dir(self.data, feat, "train", norm)
+            if has_store(path, store_sources(self.data, feat, "train", norm, source)):
+                print("using store", path)
+                pairs = FeatureStore(path).pairs()
             else:
-                train_f.append(os.path.join(self.data, feat, "train.ark"))
-            train_lab_f = os.path.join(self.data, "label", "train.lab")
-
-            # [(targets, inputs, id)]
-            pairs = read_data(train_f, train_lab_f, self.lab2id)
+                # [(targets, inputs, id)]
+                pairs = read_data(ark_files(self.data, feat, "train", source),
+                                  os.path.join(self.data, "label", "train.lab"),
+                                  self.lab2id, norm, stats, n_workers, source)
             self.max_len = max(map(lambda p: len(p[0]), pairs))
 
             random.shuffle(pairs)
@@ -44,20 +46,90 @@ class TIMIT():
 
             print("# of training %d" % (len(self.tr_set)))
             print("# of validation %d" % (len(self.valid_set)))
-        elif type == "te":
-            test_f = []
-            if feat == "all":
-                test_f.append(os.path.join(self.data, "mfcc", "test.ark"))
-                test_f.append(os.path.join(self.data, "fbank", "test.ark"))
+        elif type == "va":
+            # only the validation split of "tr": the same utterances for the
+            # same random state, without loading the training ones
+            path = store_dir(self.data, feat, "train", norm)
+            use_store = has_store(path, store_sources(self.data, feat, "train", norm, source))
+            if use_store:
+                print("using store", path)
+                store = FeatureStore(path)
+                ids = store.ids
+            else:
+                fs = ark_files(self.data, feat, "train", source)
+                ids = source_ids(fs, source)
+            # shuffles the same way as the pairs of "tr", there are as many
+            order = list(range(len(ids)))
+            random.shuffle(order)
+            if use_store:
+                self.valid_set = [store[k] for k in order[:100]]
             else:
-                test_f.append(os.path.join(self.data, feat, "test.ark"))
+                keep = set(ids[k] for k in order[:100])
+                pairs = dict((p[-1], p) for p in read_data(fs, os.path.join(self.data, "label", "train.lab"),
+                                                           self.lab2id, norm, stats, n_workers, source, keep))
+                self.valid_set = [pairs[ids[k]] for k in order[:100]]
+            self.tr_set = []
+            self.max_len = max(map(lambda p: len(p[0]), self.valid_set))
 
-            # [(inputs, id)]
-            self.te_set = read_data(test_f, None, self.lab2id)
+            print("# of validation %d" % (len(self.valid_set)))
+        elif type == "te":
+            path = store_dir(self.data, feat, "test", norm)
+            if has_store(path, store_sources(self.data, feat, "test", norm, source)):
+                print("using store", path)
+                self.te_set = FeatureStore(path).pairs()
+            else:
+                # [(inputs, id)]
+                self.te_set = read_data(ark_files(self.data, feat, "test", source), None,
+                                        self.lab2id, norm, stats, n_workers, source)
             self.max_len = max(map(lambda p: len(p[0]), self.te_set))
 
             print("# of testing %d" % (len(self.te_set)))
 
+    @staticmethod
+    def n_feat(feat):
+        if feat == "fbank":
+            return 69
+        elif feat == "all":
+            return 39 + 69
+        return 39
+
+    def frame_set(self, type="tr"):
+        if not hasattr(self, "frame_sets"):
+            self.frame_sets = {}
+        if type not in self.frame_sets:
+            self.frame_sets[type] = FrameSet(self.split(type), self.N_FEAT)
+        return self.frame_sets[type]
+
+    # (utterance, offset) frame indices of each split, for the frame-level models
+    @property
+    def tr_idx_set(self):
+        return self.frame_set("tr").index
+
+    @property
+    def va_idx_set(self):
+        return self.frame_set("va").index
+
+    @property
+    def te_idx_set(self):
+        return self.frame_set("te").index
+
+    def get_flat_batch(self, i, batch_size, frame_size, type="tr"):
+        # xss: (BATCH x frame_size x N_FEAT) windows centered on each frame
+        # yss: (BATCH) labels, or [(utterance id, offset)] for "te"
+        fs = self.frame_set(type)
+        idx = fs.index[i: i + batch_size]
+        sz = len(idx)
+
+        xss = np.zeros((batch_size, frame_size, self.N_FEAT), dtype=np.float32)
+        xss[:sz] = fs.windows(frame_size)[fs.window_start(idx, frame_size)]
+
+        if type == "te":
+            ids = [(fs.ids[u], int(j)) for (u, j) in idx]
+            return xss, ids, sz
+
+        yss = np.zeros(batch_size, dtype=np.int64)
+        yss[:sz] = fs.labels[fs.offsets[idx[:, 0]] + idx[:, 1]]
+        return xss, yss, sz
 
     def label_wt(self):
         res = torch.ones(self.N_LABEL)
@@ -66,46 +138,123 @@ class TIMIT():
             res = res.cuda()
         return res
 
-    def get_batch(self, i, batch_size, type="tr"):
+    def split(self, type="tr"):
         if type == "tr":
+            return self.tr_set
+        elif type == "va":
+            return self.valid_set
+        elif type == "te":
+            return self.te_set
+
+    def get_batch(self, i, batch_size, type="tr"):
+        idxs = range(i, min(i + batch_size, len(self.split(type))))
+        return self.get_batch_idx(idxs, type)
+
+    def get_batch_idx(self, idxs, type="tr"):
+        # idxs: indices into the split; the batch is as big as idxs
+        if type == "tr" or type == "va":
             # xss: [[[feat * 39] * seq len] * BATCH]
             # yss: [[label * seqlen] * BATCH]
-            sz = len(self.tr_set[i: i+batch_size])
+            batch = [self.split(type)[k] for k in idxs]
+            xss = [xs for (ys, xs, id) in batch]
+            yss = [ys for (ys, xs, id) in batch]
+            ids = [id for (ys, xs, id) in batch]
+            return xss, yss, ids, len(batch)
+        elif type == "te":
+            # xss: [[[feat * 39] * seq len] * BATCH]
+            # yss: ["id" * BATCH]
+            batch = [self.te_set[k] for k in idxs]
+            xss = [xs for (xs, id) in batch]
+            ids = [id for (xs, id) in batch]
+            return xss, ids, len(batch)
 
-            xss = [xs.copy() for (ys, xs, id) in self.tr_set[i: i + batch_size]]
-            xss += [np.zeros((1, self.N_FEAT)) for _ in range(batch_size - sz)]
 
-            yss = [ys.copy() for (ys, xs, id) in self.tr_set[i: i + batch_size]]
-            yss += [np.zeros(1) for _ in range(batch_size - sz)]
+class BucketSampler():
+    # groups utterances of similar length into batches. Every epoch the
+    # utterances are shuffled inside each length bucket and the batches are
+    # shuffled across buckets. With max_frames, a batch stops growing once
+    # (# of utterances x longest utterance) would go over the budget.
+    def __init__(self, lens, batch_size, n_buckets=10, max_frames=0):
+        self.lens = np.asarray(lens)
+        self.batch_size = batch_size
+        self.n_buckets = max(1, min(n_buckets, len(lens)))
+        self.max_frames = max_frames
 
-            ids = [id for (ys, xs, id) in self.tr_set[i: i + batch_size]]
-            ids += ["" for _ in range(batch_size - sz)]
+        order = np.argsort(self.lens, kind='stable')
+        self.buckets = [list(b) for b in np.array_split(order, self.n_buckets)]
 
-            return xss, yss, ids, sz
-        elif type == "va":
-            # xss: [[[feat * 39] * seq len] * BATCH]
-            # yss: [[label * seqlen] * BATCH]
-            sz = len(self.valid_set[i: i+batch_size])
+    def batches(self):
+        res = []
+        for bucket in self.buckets:
+            bucket = list(bucket)
+            random.shuffle(bucket)
+            res += self.split(bucket)
+        random.shuffle(res)
+        return res
+
+    def sorted_batches(self, idxs=None):
+        # no shuffling: batches in order of length, for evaluation
+        if idxs is None:
+            idxs = range(len(self.lens))
+        idxs = np.asarray(idxs)
+        return self.split(list(idxs[np.argsort(self.lens[idxs], kind='stable')]))
 
-            xss = [xs.copy() for (ys, xs, id) in self.valid_set[i: i + batch_size]]
-            xss += [np.zeros((1, self.N_FEAT)) for _ in range(batch_size - sz)]
+    def split(self, idxs):
+        res = []
+        cur = []
+        cur_max = 0
+        for k in idxs:
+            l = int(self.lens[k])
+            full = len(cur) == self.batch_size
+            if self.max_frames > 0 and cur:
+                full = full or (len(cur) + 1) * max(cur_max, l) > self.max_frames
+            if full:
+                res.append(cur)
+                cur = []
+                cur_max = 0
+            cur.append(k)
+            cur_max = max(cur_max, l)
+        if cur:
+            res.append(cur)
+        return res
 
-            yss = [ys.copy() for (ys, xs, id) in self.valid_set[i: i + batch_size]]
-            yss += [np.zeros(1) for _ in range(batch_size - sz)]
 
-            ids = [id for (ys, xs, id) in self.valid_set[i: i + batch_size]]
-            ids += ["" for _ in range(batch_size - sz)]
+class FrameSet():
+    # frame-level view of a split: an int32 (utterance, offset) index per
+    # frame, and for each frame_size one edge-padded copy of all utterances
+    # back to back, over which every context window is a strided view
+    def __init__(self, pairs, N_FEAT):
+        self.pairs = list(pairs)
+        self.N_FEAT = N_FEAT
+        self.ids = [p[-1] for p in self.pairs]
+        lens = np.array([len(p[-2]) for p in self.pairs], dtype=np.int64)
+        self.lens = lens
+        self.offsets = np.concatenate([[0], np.cumsum(lens)[:-1]]).astype(np.int64)
 
-            return xss, yss, ids, sz
-        elif type == "te":
-            # xss: [[[feat * 39] * seq len] * BATCH]
-            # yss: ["id" * BATCH]
-            sz = len(self.te_set[i: i+batch_size])
+        utt = np.repeat(np.arange(len(lens), dtype=np.int32), lens)
+        off = (np.arange(lens.sum()) - np.repeat(self.offsets, lens)).astype(np.int32)
+        self.index = np.stack([utt, off], axis=1)
 
-            xss = [xs.copy() for (xs, id) in self.te_set[i: i + batch_size]]
-            xss += [np.zeros((1, self.N_FEAT)) for _ in range(batch_size - sz)]
+        self.labels = None
+        if len(self.pairs) > 0 and len(self.pairs[0]) == 3:
+            self.labels = np.concatenate([p[0] for p in self.pairs]).astype(np.int64)
+        self.cache = {}
 
-            ids = [id for (xs, id) in self.te_set[i: i + batch_size]]
-            ids += ["" for _ in range(batch_size - sz)]
+    def windows(self, frame_size):
+        # (n_windows x frame_size x N_FEAT) view, no copy
+        if frame_size not in self.cache:
+            h = frame_size // 2
+            padded = np.concatenate([
+                np.pad(np.asarray(p[-2], dtype=np.float32), ((h, frame_size - 1 - h), (0, 0)), 'edge')
+                for p in self.pairs])
+            s0, s1 = padded.strides
+            view = np.lib.stride_tricks.as_strided(
+                padded, shape=(len(padded) - frame_size + 1, frame_size, self.N_FEAT),
+                strides=(s0, s0, s1), writeable=False)
+            self.cache[frame_size] = view
+        return self.cache[frame_size]
 
-            return xss, ids, sz
+    def window_start(self, idx, frame_size):
+        # every utterance grows by frame_size - 1 rows of padding
+        utt = idx[:, 0].astype(np.int64)
+        return self.offsets[utt] + utt * (frame_size - 1) + idx[:, 1]
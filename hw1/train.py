@@ -7,12 +7,12 @@ from util import *
 from timit import *
 import random
 import numpy as np
-import model_rnn
-import model_cnn
-import model_brnn
-import model_bcnn
-import model_res
-import model_bres
+from models import *
+from loader import *
+from decode import *
+from distill import *
+from recompute import res_blocks
+from phases import *
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('data', default='./data/',
@@ -30,7 +30,52 @@ parser.add_argument('-H', '--hidden_size', type=int, default=int(20))
 parser.add_argument('-b', '--batch_size', type=int, default=int(32))
 parser.add_argument('-n', '--n_layers', type=int, default=int(1))
 parser.add_argument('-d', '--dropout', type=float, default=int(0.0))
+parser.add_argument('-s', '--subsample', type=int, default=int(1),
+                    help='run the recurrent layers at 1/s of the frame rate (brnn, cnn, res)')
+parser.add_argument('--sub_mode', type=str, default='stack',
+                    help='stack or stride or pyramid')
+parser.add_argument('-C', '--checkpoint', type=str, default='',
+                    help='RES blocks (res, bres) recomputed in backward instead of stored: "all" or e.g. "1,2" or "1-3"')
+parser.add_argument('-N', '--norm', type=str, default='frame',
+                    help='frame or utt or global or none')
+parser.add_argument('-j', '--jobs', type=int, default=int(1),
+                    help='processes for parsing the ark files')
+parser.add_argument('-S', '--source', type=str, default='text',
+                    help='text (.ark dumps) or kaldi (binary .ark/.scp)')
 parser.add_argument('-M', '--Model', type=str, default='')
+parser.add_argument('-W', '--prefetch', type=int, default=int(0),
+                    help='# of batches prepared ahead in worker threads (0: serial)')
+parser.add_argument('--seed', type=int, default=None)
+parser.add_argument('--phases', action='store_true',
+                    help='print where each epoch spent its time (batch, forward, loss, backward, step)')
+parser.add_argument('--trace', type=str, default='',
+                    help='write a Chrome trace (chrome://tracing) of the --trace_iters iterations to this file')
+parser.add_argument('--trace_iters', type=str, default='10:20',
+                    help='first:last training iteration to trace, counted over all epochs')
+parser.add_argument('--teacher', type=str, default='',
+                    help='distill from this frozen model file in models/')
+parser.add_argument('--teacher_model', type=str, default='brnn',
+                    help='teacher model (rnn or cnn or brnn or bcnn or res or bres)')
+parser.add_argument('--teacher_feat', type=str, default='',
+                    help='teacher features (default: the same as the student, otherwise needs --teacher_cache)')
+parser.add_argument('--teacher_H', type=int, default=int(1024))
+parser.add_argument('--teacher_n', type=int, default=int(6))
+parser.add_argument('--teacher_cache', action='store_true',
+                    help='compute the teacher logits once into data/store/ and read them back every epoch')
+parser.add_argument('--kd_T', type=float, default=float(2.0),
+                    help='distillation temperature')
+parser.add_argument('--kd_alpha', type=float, default=float(0.5),
+                    help='weight of the distillation loss, 1 - kd_alpha goes to the hard labels')
+parser.add_argument('--name', type=str, default='',
+                    help='save as models/<name>.e<epoch>.pt instead of a name made of the hyper-parameters')
+parser.add_argument('-B', '--bucket', type=int, default=int(0),
+                    help='# of length buckets for batching (0: plain shuffle)')
+parser.add_argument('-F', '--max_frames', type=int, default=int(0),
+                    help='max (batch x maxlen) frames per bucketed batch (0: no limit)')
+parser.add_argument('-E', '--eval_batch_size', type=int, default=int(0),
+                    help='batch size for validation (0: same as -b)')
+parser.add_argument('--eval_frames', type=int, default=int(0),
+                    help='max (batch x maxlen) frames per validation batch (0: no limit)')
 
 args = parser.parse_args()
 
@@ -41,28 +86,25 @@ HIDDEN_SIZE = args.hidden_size
 POOL_SIZE = args.pool_size
 WINDOW_SIZE = (args.window_size_x, args.window_size_y)
 BATCH_SIZE = args.batch_size
+EVAL_BATCH_SIZE = args.eval_batch_size or BATCH_SIZE
 N_LAYERS = args.n_layers
 DROPOUT = args.dropout
 
 print_every = 10
 plot_every = 10
 
+if args.seed is not None:
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+
 print(args.model, args.feat, LR, N_EPOCH, HIDDEN_SIZE, N_LAYERS, BATCH_SIZE, WINDOW_SIZE, DROPOUT)
 
-timit = TIMIT(args.data, "tr", args.feat)
-
-if args.model == "rnn":
-    model = model_rnn.RNN(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "brnn":
-    model = model_brnn.BRNN(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "cnn":
-    model = model_cnn.CNN(timit.N_FEAT, WINDOW_SIZE, POOL_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "bcnn":
-    model = model_bcnn.BCNN(timit.N_FEAT, WINDOW_SIZE, POOL_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "res":
-    model = model_res.RESR(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
-elif args.model == "bres":
-    model = model_bres.BRESR(timit.N_FEAT, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
+timit = TIMIT(args.data, "tr", args.feat, args.norm, args.jobs, args.source)
+
+model = build_model(args.model, timit.N_FEAT, timit.N_LABEL, HIDDEN_SIZE, BATCH_SIZE,
+                    N_LAYERS, DROPOUT, WINDOW_SIZE, POOL_SIZE, args.subsample, args.sub_mode,
+                    res_blocks(args.checkpoint))
 
 if USE_CUDA:
     model.cuda()
@@ -73,86 +115,151 @@ if args.Model != '':
     model.load_state_dict(state_dict)
 
 opt = torch.optim.Adam(model.parameters(), lr = LR)
-criterion = nn.CrossEntropyLoss(timit.label_wt())
+label_wt = Variable(timit.label_wt())
+codes = char_codes(timit.id2ascii, timit.N_LABEL)
+SIL = codes[timit.lab2id['sil']]
+loader = Prefetcher(timit, BATCH_SIZE, args.prefetch, max(1, args.prefetch // 2))
+
+teacher = None
+teacher_cache = None
+if args.teacher != '':
+    teacher_feat = args.teacher_feat or args.feat
+    if teacher_feat != args.feat and not args.teacher_cache:
+        raise SystemExit("a teacher on %s features needs --teacher_cache" % teacher_feat)
+    teacher = build_model(args.teacher_model, TIMIT.n_feat(teacher_feat), timit.N_LABEL,
+                          args.teacher_H, BATCH_SIZE, args.teacher_n)
+    teacher.load_state_dict(torch.load(os.path.join("models", args.teacher),
+                                       map_location=lambda storage, location: storage))
+    teacher = teacher.eval()
+    for p in teacher.parameters():
+        p.requires_grad = False
+    if USE_CUDA:
+        teacher.cuda()
+
+    if args.teacher_cache:
+        path = teacher_cache_dir(args.data, args.teacher, teacher_feat, args.norm)
+        # a retrained teacher or new arks / cmvn make the cached logits stale
+        sources = [os.path.join("models", args.teacher)] + \
+            store_sources(args.data, teacher_feat, "train", args.norm, args.source)
+        if not all(os.path.exists(f) for f in sources) or not has_store(path, sources):
+            t_timit = timit
+            if teacher_feat != args.feat:
+                # TIMIT shuffles its split; keep the student's random state
+                # so a seeded run shuffles the same with or without a cache
+                state = random.getstate()
+                t_timit = TIMIT(args.data, "tr", teacher_feat, args.norm, args.jobs, args.source)
+                random.setstate(state)
+            build_store(teacher_logits(teacher, t_timit, BATCH_SIZE), path, np.float16, sources)
+            del t_timit
+        teacher_cache = TeacherCache(path)
+        teacher = None
+    print("distilling from %s, T %g alpha %g%s" % (
+        args.teacher, args.kd_T, args.kd_alpha, " (cached)" if teacher_cache else ""))
 
 cnt = 0
 
 def batch_eval(inp, target, ids, useful, lens):
-    # inp: (BATCH_SIZE x maxlen x N_FEAT)
-    # target: (BATCH_SIZE x maxlen)
-    hidden = model.init_hidden()
-    output, hidden = model(inp, hidden, lens)
-
-    acc = 0
-    loss = 0
+    # inp: (batch x maxlen x N_FEAT)
+    # target: (batch x maxlen)
+    with torch.no_grad():
+        hidden = model.init_hidden(len(lens))
+        output, hidden = model(inp, hidden, lens)
 
-    for i in range(useful):
-        loss += criterion(output[i][:lens[i]], target[i][:lens[i]]).data[0] * lens[i]
-        my_y = output[i].max(1)[1].data[:lens[i]]
-        ta_y = target[i].data[:lens[i]]
-        acc += sum(ta_y == my_y)
+    lens_var = Variable(torch.FloatTensor(lens[:useful]))
+    if USE_CUDA:
+        lens_var = lens_var.cuda()
+    # frame-weighted sums over the real utterances
+    loss = (masked_ce(output, target, lens, label_wt)[:useful] * lens_var).sum().item()
+    acc = masked_acc(output, target, lens)[:useful].sum().item()
 
-#        if i == 0:
-#            print(ids[i])
-#            print(list(my_y[:40]))
-#            print(list(my_y[-40:]))
-#            print(list(ta_y[:40]))
-#            print(list(ta_y[-40:]))
+    # phone edit distance after trim, against the collapsed labels
+    ys = output.max(2)[1].data.cpu().numpy()
+    ts = target.data.cpu().numpy()
+    hyps = [trim(codes[ys[i, :lens[i]]], SIL) for i in range(useful)]
+    refs = [trim(codes[ts[i, :lens[i]]], SIL, 1) for i in range(useful)]
+    dist = edit_distances(hyps, refs).sum()
 
-    return loss, acc
+    return loss, acc, dist
 
 
 def eval_valid(epoch):
     loss = 0
     acc = 0
-    v_len = len(timit.valid_set)
-    random.shuffle(timit.valid_set)
+    dist = 0
     tot_len = 0
+    start = time.time()
     model.eval()
-    for i in range(0, v_len, BATCH_SIZE):
-        input, target, ids, useful = timit.get_batch(i, BATCH_SIZE, "va")
-        input, target, ids, lens = make_batch(input, target, ids, timit.N_FEAT)
-        tloss, tacc = batch_eval(input, target, ids, useful, lens)
+    for input, target, ids, useful, lens in loader(valid_batches, "va"):
+        tloss, tacc, tdist = batch_eval(input, target, ids, useful, lens)
         loss += tloss
         acc  += tacc
+        dist += tdist
         tot_len += sum(lens[:useful])
 
     loss /= tot_len
     acc /= tot_len
-    # acc /= v_len
+    dist /= len(timit.valid_set)
 
-    print("  epoch %d VALID LOSS %f ACC %f%%" % (epoch, loss, acc * 100))
+    print("  epoch %d VALID LOSS %f ACC %f%% EDIT DISTANCE %f (%.1f frames/s)" % (
+        epoch, loss, acc * 100, dist, tot_len / (time.time() - start)))
 
     return loss, acc
 
 
+# validation batches in order of length, so each one has little padding
+valid_batches = BucketSampler([len(ys) for (ys, xs, id) in timit.valid_set],
+                              EVAL_BATCH_SIZE, 1, args.eval_frames).sorted_batches()
+
+sampler = None
+if args.bucket > 0:
+    sampler = BucketSampler([len(ys) for (ys, xs, id) in timit.tr_set],
+                            BATCH_SIZE, args.bucket, args.max_frames)
+
+timer = PhaseTimer(args.phases, args.trace, trace_range(args.trace_iters))
+
 eval_valid(0)
 iter = 1
 start = time.time()
 for epoch in range(1, N_EPOCH + 1):
     loss_tot = 0
-    random.shuffle(timit.tr_set)
+    loader.wait_time = 0
+    real_frames = 0
+    pad_frames = 0
+    epoch_start = time.time()
+    if sampler is not None:
+        batches = sampler.batches()
+    else:
+        random.shuffle(timit.tr_set)
+        batches = seq_batches(len(timit.tr_set), BATCH_SIZE)
     model.train()
-    for i in range(0, len(timit.tr_set), BATCH_SIZE):
-        input, target, ids, useful = timit.get_batch(i, BATCH_SIZE)
-
-        input, target, ids, lens = make_batch(input, target, ids, timit.N_FEAT)
-
-        model.zero_grad()
-        hidden = model.init_hidden()
-        output, hidden = model(input, hidden, lens)
-
-        loss = 0
-        for j in range(useful):
-            loss += criterion(output[j][:lens[j]], target[j][:lens[j]])
-
-        if USE_CUDA:
-            loss.cuda()
-
-        loss.backward()
-        opt.step()
-
-        loss = loss.data[0] / useful
+    timer.begin()
+    for b, (input, target, ids, useful, lens) in enumerate(loader(batches)):
+        timer.iteration(iter)
+        real_frames += sum(lens[:useful])
+        pad_frames += useful * lens[0]
+
+        with timer("forward"):
+            model.zero_grad()
+            hidden = model.init_hidden(len(lens))
+            output, hidden = model(input, hidden, lens)
+
+        with timer("loss"):
+            loss = masked_ce(output, target, lens, label_wt)
+            if teacher_cache is not None or teacher is not None:
+                if teacher_cache is not None:
+                    t_output = Variable(teacher_cache.batch(ids, output.size(1)))
+                else:
+                    with torch.no_grad():
+                        t_output, t_hidden = teacher(input, teacher.init_hidden(len(lens)), lens)
+                loss = (1 - args.kd_alpha) * loss + args.kd_alpha * masked_kd(output, t_output, lens, args.kd_T)
+            loss = loss[:useful].sum()
+
+        with timer("backward"):
+            loss.backward()
+        with timer("step"):
+            opt.step()
+
+        loss = loss.item() / useful
 
         loss_tot += loss
 
@@ -165,12 +272,19 @@ for epoch in range(1, N_EPOCH + 1):
             print('[%s (%d %d%%) %.4f %.4f]' %
                   (time_since(start),
                    iter,
-                   iter / (N_EPOCH * len(timit.tr_set)) * 100,
+                   iter / (N_EPOCH * len(batches)) * 100,
                    loss,
-                   loss_tot / (i//BATCH_SIZE+1)))
+                   loss_tot / (b + 1)))
 
         iter += 1
 
+    print("  epoch %d PADDING EFFICIENCY %f%% (%d batches)" %
+          (epoch, real_frames / pad_frames * 100, len(batches)))
+    # with -W this is only the time spent waiting on the prefetch queue
+    print("  epoch %d BATCH ASSEMBLY %.2fs of %s" % (epoch, loader.wait_time, time_since(epoch_start)))
+    print("  epoch %d TRAIN %.1f frames/s" % (epoch, real_frames / (time.time() - epoch_start)))
+    timer.epoch(epoch, loader.wait_time)
+
     eval_valid(epoch)
     model_name = args.model
 
@@ -181,4 +295,11 @@ for epoch in range(1, N_EPOCH + 1):
         model_name += (".%s.e%d.h%d.b%d.l%d.d%g.pt" % (
             args.feat, epoch, HIDDEN_SIZE, BATCH_SIZE, N_LAYERS, DROPOUT))
 
+    if args.subsample > 1:
+        model_name = model_name[:-len(".pt")] + ".s%d%s.pt" % (args.subsample, args.sub_mode)
+    if args.name != '':
+        model_name = "%s.e%d.pt" % (args.name, epoch)
+
     torch.save(model.state_dict(), os.path.join("models", model_name))
+
+timer.stop()
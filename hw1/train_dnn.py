@@ -10,12 +10,15 @@ import model_rnn
 import model_cnn
 import model_brnn
 import model_dnn
+import model_dcnn
 
 parser = argparse.ArgumentParser(description='')
 parser.add_argument('data', default='./data/',
                     help='data folder')
 parser.add_argument('feat', default='mfcc',
                     help='mfcc or fbank')
+parser.add_argument('--model', type=str, default='dnn',
+                    help='model (dnn or dcnn)')
 parser.add_argument('--lr', type=float, default=float(0.1))
 parser.add_argument('--n_epoch', type=int, default=int(3))
 parser.add_argument('--hidden_size', type=int, default=int(20))
@@ -44,7 +47,10 @@ print(args.feat, LR, N_EPOCH, HIDDEN_SIZE, N_LAYERS, BATCH_SIZE, FRAME_SIZE, WIN
 
 timit = TIMIT(args.data, "tr", args.feat)
 
-model = model_dnn.DNN(timit.N_FEAT, FRAME_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
+if args.model == "dnn":
+    model = model_dnn.DNN(timit.N_FEAT, FRAME_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE)
+elif args.model == "dcnn":
+    model = model_dcnn.CNN(timit.N_FEAT, FRAME_SIZE, HIDDEN_SIZE, timit.N_LABEL, BATCH_SIZE, N_LAYERS, DROPOUT)
 
 if USE_CUDA:
     model = model.cuda()
@@ -57,8 +63,7 @@ def train(inp, target, useful):
     # inp: (BATCH_SIZE x frame x N_FEAT)
     # target: (BATCH_SIZE)
     if USE_CUDA:
-        inp.cuda()
-        target.cuda()
+        inp, target = inp.cuda(), target.cuda()
     model.train()
     opt.zero_grad()
     output = model(inp)
@@ -68,21 +73,20 @@ def train(inp, target, useful):
     loss.backward()
     opt.step()
 
-    return loss.data[0]
+    return loss.item()
 
 
 def batch_eval(inp, target, useful):
     # inp: (BATCH_SIZE x maxlen x N_FEAT)
     # target: (BATCH_SIZE x maxlen)
     if USE_CUDA:
-        inp.cuda()
-        target.cuda()
+        inp, target = inp.cuda(), target.cuda()
     output = model(inp)
 
-    loss = criterion(output[:useful], target[:useful]).data[0]
+    loss = criterion(output[:useful], target[:useful]).item()
 
     my_y = output.max(1)[1]
-    acc = sum(my_y[:useful] == target[:useful]).data[0] / useful
+    acc = (my_y[:useful] == target[:useful]).float().sum().item() / useful
 
     return loss, acc
 
@@ -90,13 +94,13 @@ def batch_eval(inp, target, useful):
 def eval_valid():
     loss = 0
     acc = 0
-    v_len = len(timit.valid_set)
+    v_len = len(timit.va_idx_set)
     tot_len = 0
     model.eval()
     for i in range(0, v_len, BATCH_SIZE):
         xss, yss, useful = timit.get_flat_batch(i, BATCH_SIZE, FRAME_SIZE, "va")
-        X = Variable(torch.Tensor(xss))
-        Y = Variable(torch.LongTensor(yss))
+        X = Variable(torch.from_numpy(xss))
+        Y = Variable(torch.from_numpy(yss))
         tloss, tacc = batch_eval(X, Y, useful)
         loss += tloss * useful
         acc  += tacc * useful
@@ -118,12 +122,13 @@ loss_tot = 0
 iter = 1
 eval_valid()
 for epoch in range(1, N_EPOCH + 1):
-    random.shuffle(timit.tr_idx_set)
+    # random.shuffle would corrupt the rows of a 2-d array
+    np.random.shuffle(timit.tr_idx_set)
     for i in range(0, len(timit.tr_idx_set), BATCH_SIZE):
         xss, yss, useful = timit.get_flat_batch(i, BATCH_SIZE, FRAME_SIZE)
 
-        X = Variable(torch.Tensor(xss))
-        Y = Variable(torch.LongTensor(yss))
+        X = Variable(torch.from_numpy(xss))
+        Y = Variable(torch.from_numpy(yss))
 
         loss = train(X, Y, useful)
 
@@ -132,7 +137,7 @@ for epoch in range(1, N_EPOCH + 1):
 
         if iter % print_every == 0:
             print('[%s (%d %d%%) %.4f %.4f]' %
-                  (time_since(start), iter, iter / (N_EPOCH * len(timit.tr_set)) * 100, loss, loss_tot / iter))
+                  (time_since(start), iter, iter / (N_EPOCH * len(timit.tr_idx_set) / BATCH_SIZE) * 100, loss, loss_tot / iter))
 
         if iter % plot_every == 0:
             all_losses.append(loss_avg / plot_every)
@@ -143,7 +148,7 @@ for epoch in range(1, N_EPOCH + 1):
     torch.save(
         model.state_dict(),
         os.path.join("models", 
-        ("dnn.e%d.h%d.b%d.l%d.f%d.pt" % (epoch, HIDDEN_SIZE, BATCH_SIZE, N_LAYERS, FRAME_SIZE))))
+        ("%s.e%d.h%d.b%d.l%d.f%d.pt" % (args.model, epoch, HIDDEN_SIZE, BATCH_SIZE, N_LAYERS, FRAME_SIZE))))
 
 print(all_losses)
 
@@ -1,10 +1,15 @@
 import time, math
 import torch
+import torch.nn.functional as F
 from torch.autograd import Variable
 from torch.nn.utils.rnn import pack_padded_sequence, pad_packed_sequence
 import copy
+import os
+import resource
 import numpy as np
-from scipy import stats
+from ark import *
+from store import *
+from decode import uniform_transitions, estimate_transitions
 
 USE_CUDA = torch.cuda.is_available()
 
@@ -33,6 +38,18 @@ def make_lab2id(fn, fn2):
     return lab2id, id2ascii
 
 
+def load_transitions(trans, data_folder, lab2id, n_label, self_loop=0.9):
+    # log phone-transition matrix for decode.viterbi:
+    # "" uniform with self_loop, "train" bigrams of the training labels,
+    # anything else a saved (n_label x n_label) .npy of log probabilities
+    if trans == "":
+        return uniform_transitions(n_label, self_loop)
+    if trans == "train":
+        y = read_labels(os.path.join(data_folder, "label", "train.lab"), lab2id)
+        return estimate_transitions(y.values(), n_label)
+    return np.load(trans)
+
+
 def get_pad(seq, i, lsz, rsz, pad):
     l = i - lsz
     r = i + rsz + 1
@@ -57,50 +74,143 @@ def pad_label(seq, max_len):
     return seq
 
 
-def make_batch(xss, yss, ids, N_FEAT):
-    # xss: batch_size x len x n_feat
-    # yss: batch_size x len
-    seq_pairs = sorted(zip(xss, yss, ids), key=lambda p:len(p[1]), reverse=True)
-    xss, yss, ids = zip(*seq_pairs)
-
-    lens = [len(xs) for xs in xss]
-    max_len = max(lens)
-    xss_pad = [np.pad(xs, ((0, max_len - len(xs)), (0, 0)), 'constant', constant_values=0) for xs in xss]
-    xss_pad = np.array(xss_pad)
-    yss_pad = [np.pad(ys, (0, max_len - len(ys)), 'constant', constant_values=0) for ys in yss]
-    yss_pad = np.array(yss_pad)
-
-    # (batch_size x maxlen)
-    xss_var = Variable(torch.from_numpy(xss_pad))
-    xss_var = xss_var.type(torch.FloatTensor)
-    yss_var = Variable(torch.from_numpy(yss_pad))
-    yss_var = yss_var.type(torch.LongTensor)
+class Collator():
+    # pads a batch straight into one reusable float32 / int64 buffer (pinned
+    # when asked and on CUDA) and returns tensors that view it, so a batch is
+    # copied once on the host. The next call overwrites the previous batch.
+    def __init__(self, N_FEAT, pin_memory=False):
+        self.N_FEAT = N_FEAT
+        self.pin_memory = pin_memory and USE_CUDA
+        self.x_buf = torch.FloatTensor(0)
+        self.y_buf = torch.LongTensor(0)
+
+    def grow(self, buf, n):
+        if buf.numel() >= n:
+            return buf
+        buf = buf.new(max(n, 2 * buf.numel()))
+        if self.pin_memory:
+            buf = buf.pin_memory()
+        return buf
+
+    def __call__(self, xss, yss, ids):
+        # xss: batch_size x len x n_feat
+        # yss: batch_size x len, or None for test batches
+        lens = np.array([len(xs) for xs in xss])
+        # same order as a stable sort by length, longest first
+        perm = np.argsort(-lens, kind='stable')
+        lens = lens[perm]
+        B, T = len(xss), int(lens[0])
+
+        self.x_buf = self.grow(self.x_buf, B * T * self.N_FEAT)
+        x = self.x_buf[:B * T * self.N_FEAT].view(B, T, self.N_FEAT)
+        x_np = x.numpy()
+        for k, p in enumerate(perm):
+            x_np[k, :lens[k]] = xss[p]
+            x_np[k, lens[k]:] = 0
+        xss_var = Variable(x)
+        if USE_CUDA:
+            xss_var = xss_var.cuda(non_blocking=self.pin_memory)
+
+        ids = tuple(ids[p] for p in perm)
+        lens = lens.tolist()
+        if yss is None:
+            return xss_var, ids, lens
+
+        self.y_buf = self.grow(self.y_buf, B * T)
+        y = self.y_buf[:B * T].view(B, T)
+        y_np = y.numpy()
+        for k, p in enumerate(perm):
+            y_np[k, :lens[k]] = yss[p]
+            y_np[k, lens[k]:] = 0
+        yss_var = Variable(y)
+        if USE_CUDA:
+            yss_var = yss_var.cuda(non_blocking=self.pin_memory)
+
+        return xss_var, yss_var, ids, lens
 
-    if USE_CUDA:
-        xss_var, yss_var = xss_var.cuda(), yss_var.cuda()
 
-    return xss_var, yss_var, ids, lens
+def make_batch(xss, yss, ids, N_FEAT):
+    # (batch_size x maxlen), in a fresh buffer
+    return Collator(N_FEAT)(xss, yss, ids)
 
 
 def make_batch_te(xss, ids, N_FEAT):
-    # xss: batch_size x len x n_feat
-    # ids: batch_size
-    seq_pairs = sorted(zip(xss, ids), key=lambda p:len(p[0]), reverse=True)
-    xss, ids = zip(*seq_pairs)
-
-    lens = [len(xs) for xs in xss]
-    max_len = max(lens)
-    xss_pad = [np.pad(xs, ((0, max_len - len(xs)), (0, 0)), 'constant', constant_values=0) for xs in xss]
-    xss_pad = np.array(xss_pad)
+    return Collator(N_FEAT)(xss, None, ids)
 
-    # (batch_size x maxlen)
-    xss_var = Variable(torch.from_numpy(xss_pad))
-    xss_var = xss_var.type(torch.FloatTensor)
 
+def seq_mask(lens, max_len):
+    # (batch x maxlen) 1.0 on real frames, 0.0 on padding
+    lens = torch.LongTensor(lens)
+    mask = (torch.arange(0, max_len).long().unsqueeze(0) < lens.unsqueeze(1)).float()
     if USE_CUDA:
-        xss_var = xss_var.cuda()
-
-    return xss_var, ids, lens
+        mask = mask.cuda()
+    return Variable(mask)
+
+
+def masked_ce(output, target, lens, weight=None):
+    # output: (batch x maxlen x n_label), target: (batch x maxlen)
+    # per-utterance loss, (batch): for every j the same value as
+    # nn.CrossEntropyLoss(weight)(output[j][:lens[j]], target[j][:lens[j]]),
+    # i.e. a weight-normalized mean over the utterance's own frames
+    B, T, C = output.size()
+    mask = seq_mask(lens, T)
+    logp = F.log_softmax(output.view(-1, C), dim=1)
+    nll = -logp.gather(1, target.view(-1, 1)).view(B, T)
+    if weight is not None:
+        mask = mask * weight.index_select(0, target.view(-1)).view(B, T)
+    return (nll * mask).sum(1) / mask.sum(1)
+
+
+def masked_kd(output, teacher, lens, T=1.0):
+    # output, teacher: (batch x maxlen x n_label) logits
+    # per-utterance distillation loss, (batch): mean over the utterance's own
+    # frames of T^2 * KL(softmax(teacher / T) || softmax(output / T))
+    B, L, C = output.size()
+    mask = seq_mask(lens, L)
+    logp = F.log_softmax(output / T, dim=2)
+    logq = F.log_softmax(teacher / T, dim=2)
+    kl = (logq.exp() * (logq - logp)).sum(2)
+    return T * T * (kl * mask).sum(1) / mask.sum(1)
+
+
+def masked_acc(output, target, lens):
+    # (batch) # of correctly labelled frames per utterance
+    mask = seq_mask(lens, output.size(1))
+    return ((output.max(2)[1] == target).float() * mask).sum(1)
+
+
+def largest_batch(batches, mbs, mem):
+    # largest batch size within mem MB, from a line through the (batch size,
+    # MB) measurements; None when they do not grow with the batch (less
+    # than 1% over the measured range says nothing about larger batches)
+    # or not even one utterance fits
+    if len(batches) > 1:
+        slope, icpt = np.polyfit(batches, mbs, 1)
+    else:
+        slope, icpt = mbs[0] / batches[0], 0
+    if not (np.isfinite(slope) and np.isfinite(icpt) and slope > 0):
+        return None
+    if slope * max(batches) < 0.01 * max(mbs):
+        return None
+    res = (mem - icpt) // slope
+    if not (np.isfinite(res) and res >= 1):
+        return None
+    return int(res)
+
+
+def batch_str(b):
+    return "n/a" if b is None else "%d" % b
+
+
+def rss_mb():
+    # resident memory of this process now (Linux)
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2 ** 20
+
+
+def peak_rss_mb():
+    # highest resident memory of this process so far; it never goes down
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 2 ** 10
 
 
 def time_since(since):
@@ -110,54 +220,164 @@ def time_since(since):
     return '%dm %ds' % (m, s)
 
 
-def read_data(fs, lab_f, lab2id):
-    print(fs, lab_f)
-    X = {}
-    y = {}
-
-    frames = {}
-    for f in fs:
-        with open(f, 'r') as fp:
-            for line in fp.readlines():
-                words = line[:-1].split()
-                frame_id = words[0]
-                if frame_id not in frames:
-                    frames[frame_id] = []
-                frames[frame_id].extend(map(float, words[1:]))
-    print("tot # of frames: ", len(frames))
-
-    frame_ids = sorted(list(frames.keys()), key=lambda s: int(s.split('_')[2]))
-    for frame_id in frame_ids:
-        feat = frames[frame_id]
-        spid, seid, fid = frame_id.split('_')
-        id = spid + '_' + seid
-        feat = stats.zscore(feat)
-        if id not in X:
-            X[id] = []
-        X[id].append(feat)
-
-    if lab_f == None:
-        res = []
-        for k in X.keys():
-            res.append((np.array(X[k]), k))
-        return res
-
-    with open(lab_f, 'r') as f:
-        for line in f.readlines():
-            words = line[:-1].split(',')
-            frame_id = words[0]
-
-            spid, seid, fid = frame_id.split('_')
-            id = spid + '_' + seid
-
-            lab = words[1]
-            if id not in y:
-                y[id] = []
-            y[id].append(lab2id[lab])
-
-    res = []
-    for k in X.keys():
-        res.append((np.array(y[k]), np.array(X[k]), k))
+def ark_files(data_folder, feat, split, source="text"):
+    # text: kaldi text dumps <feat>/<split>.ark
+    # kaldi: binary arks indexed by <feat>/<split>.scp
+    ext = ".scp" if source == "kaldi" else ".ark"
+    if feat == "all":
+        return [os.path.join(data_folder, "mfcc", split + ext),
+                os.path.join(data_folder, "fbank", split + ext)]
+    return [os.path.join(data_folder, feat, split + ext)]
+
 
+def source_files(fs, source="text"):
+    # every file the utterances are read from: the arks, and for kaldi the
+    # scps and the binary arks they point to
+    res = list(fs)
+    if source == "kaldi":
+        for f in fs:
+            res += sorted(set(path for path, offset in KaldiScp(f).entries.values()))
     return res
 
+
+def store_sources(data_folder, feat, split, norm="frame", source="text"):
+    # what the store of a split is built from, for has_store / build_store
+    fs = source_files(ark_files(data_folder, feat, split, source), source)
+    if split == "train":
+        fs.append(os.path.join(data_folder, "label", "train.lab"))
+    if norm == "global":
+        fs.append(cmvn_file(data_folder, feat))
+    return fs
+
+
+def iter_source(fs, source="text", n_workers=1, keep=None):
+    if source == "kaldi":
+        return iter_kaldi_utts(fs, keep)
+    elif source == "text":
+        return iter_utts(fs, n_workers=n_workers, keep=keep)
+    raise ValueError("unknown source %s" % source)
+
+
+def source_ids(fs, source="text"):
+    # utterance ids in the order iter_source yields them, without parsing
+    if source == "kaldi":
+        return KaldiScp(fs[0]).ids
+    elif source == "text":
+        return ark_ids(fs[0])
+    raise ValueError("unknown source %s" % source)
+
+
+NORMS = ("frame", "utt", "global", "none")
+
+
+class CMVNStats():
+    # running per-dimension mean / variance, merged one block of frames at a
+    # time (Chan et al.) so the global statistics never need all frames at once
+    def __init__(self, n_feat=None):
+        self.n = 0
+        self.mean = None
+        self.m2 = None
+        if n_feat is not None:
+            self.mean = np.zeros(n_feat)
+            self.m2 = np.zeros(n_feat)
+
+    def update(self, xs):
+        xs = np.asarray(xs, dtype=np.float64)
+        n = len(xs)
+        if n == 0:
+            return
+        mean = xs.mean(0)
+        m2 = ((xs - mean) ** 2).sum(0)
+        if self.n == 0:
+            self.n, self.mean, self.m2 = n, mean, m2
+            return
+        tot = self.n + n
+        delta = mean - self.mean
+        self.mean = self.mean + delta * n / tot
+        self.m2 = self.m2 + m2 + delta ** 2 * self.n * n / tot
+        self.n = tot
+
+    def std(self):
+        return np.sqrt(self.m2 / self.n)
+
+    def save(self, fn):
+        np.save(fn, np.stack([self.mean, self.std()]))
+
+    @staticmethod
+    def load(fn):
+        mean, std = np.load(fn)
+        return mean, std
+
+
+def normalize(xs, norm="frame", stats=None):
+    # xs: (n_frames x n_feat), a single utterance or the full frame matrix
+    # frame:  z-score every frame over its features (same as stats.zscore)
+    # utt:    per-utterance CMVN, xs must be one utterance
+    # global: CMVN with stats = (mean, std) from the training set
+    xs = np.asarray(xs, dtype=np.float64)
+    if norm == "frame":
+        mean = xs.mean(1, keepdims=True)
+        std = xs.std(1, keepdims=True)
+    elif norm == "utt":
+        mean = xs.mean(0)
+        std = xs.std(0)
+    elif norm == "global":
+        mean, std = stats
+    elif norm == "none":
+        return xs
+    else:
+        raise ValueError("unknown norm %s" % norm)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        return (xs - mean) / std
+
+
+def cmvn_file(data_folder, feat):
+    return os.path.join(data_folder, "store", "%s.cmvn.npy" % feat)
+
+
+def global_cmvn(data_folder, feat, n_workers=1, source="text"):
+    # global stats always come from the training arks, streamed one
+    # utterance at a time, and are cached next to the feature store with
+    # the fingerprint of the arks; other or newer arks compute them again
+    fn = cmvn_file(data_folder, feat)
+    fs = ark_files(data_folder, feat, "train", source)
+    sources = fn[:-len(".npy")] + ".sources.json"
+    if os.path.exists(fn):
+        if same_fingerprint(sources, source_files(fs, source)):
+            return CMVNStats.load(fn)
+        print("%s was computed from other or older files, computing it again" % fn)
+    cmvn = CMVNStats()
+    for id, xs in iter_source(fs, source, n_workers):
+        cmvn.update(xs)
+    os.makedirs(os.path.dirname(fn), exist_ok=True)
+    cmvn.save(fn)
+    save_fingerprint(sources, source_files(fs, source))
+    print("global cmvn over %d frames saved to %s" % (cmvn.n, fn))
+    return cmvn.mean, cmvn.std()
+
+
+def iter_data(fs, y, norm="frame", stats=None, n_workers=1, source="text", keep=None):
+    # streams (targets, inputs, id), or (inputs, id) when y is None; only the
+    # utterances in keep, if given
+    if norm == "global" and stats is None:
+        cmvn = CMVNStats()
+        for id, xs in iter_source(fs, source, n_workers):
+            cmvn.update(xs)
+        stats = (cmvn.mean, cmvn.std())
+    for id, xs in iter_source(fs, source, n_workers, keep):
+        xs = normalize(xs, norm, stats).astype(np.float32)
+        if y is None:
+            yield (xs, id)
+        else:
+            yield (y[id], xs, id)
+
+
+def read_data(fs, lab_f, lab2id, norm="frame", stats=None, n_workers=1, source="text", keep=None):
+    print(fs, lab_f)
+    y = None
+    if lab_f != None:
+        y = read_labels(lab_f, lab2id)
+
+    res = list(iter_data(fs, y, norm, stats, n_workers, source, keep))
+    print("tot # of frames: ", sum(len(p[-2]) for p in res))
+    return res